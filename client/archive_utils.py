@@ -1,31 +1,92 @@
 import os
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from common.protocol import MESSAGE_TYPES
+from common.logger import get_logger
+from common.scanner import scan_tree, SCAN_WORKERS
+from common.fingerprint import (
+    compute_fingerprint,
+    load_fingerprint_cache,
+    save_fingerprint_cache,
+    lookup_fingerprint,
+    store_fingerprint
+)
 
+logger = get_logger("ARCHIVE UTILS")
 
-def get_local_file_index(base_path):
+# Directory inside the archive used for restore bookkeeping; never indexed or uploaded
+RESTORE_STATE_DIR = ".filesync-restore"
+
+# Content fingerprints of local files, keyed by absolute path and reused while size and mtime match
+FINGERPRINT_CACHE_FILE = "client_fingerprints.json"
+
+
+def get_local_file_index(base_path, workers=SCAN_WORKERS):
     # Collects metadata for all files in the given directory (recursively)
     files = []
-    for root, _, filenames in os.walk(base_path):
-        for filename in filenames:
-            try:
-                full_path = os.path.join(root, filename)
-                rel_path = os.path.relpath(full_path, base_path).replace("\\", "/")
-                mod_time = os.path.getmtime(full_path)  # May raise FileNotFoundError
-                files.append({
-                    "filename": filename,
-                    "path": rel_path,
-                    "mod_time": mod_time
-                })
-            except (OSError, FileNotFoundError) as e:
-                # Skips files that cannot be accessed
-                print(f"[ARCHIVE UTILS] Skipping file '{filename}' due to error: {e}")
+    for rel_path, filename, st, error in scan_tree(base_path, workers, skip_dirs=(RESTORE_STATE_DIR,)):
+        if error:
+            # Skips files that cannot be accessed
+            logger.warning("Skipping file '%s' due to error: %s", filename, error)
+            continue
+        files.append({
+            "filename": filename,
+            "path": rel_path,
+            "mod_time": st.st_mtime,
+            "size": st.st_size
+        })
+    return files
+
+
+def hash_local_file(full_path):
+    # Computes the fingerprint of one local file (runs in the hashing pool)
+    with open(full_path, "rb") as f:
+        return compute_fingerprint(f)
+
+
+def add_fingerprints(base_path, files, workers=SCAN_WORKERS):
+    # Adds a "fingerprint" to every index entry, hashing only files whose size or mtime changed
+    cache = load_fingerprint_cache(FINGERPRINT_CACHE_FILE)
+    base_path = os.path.abspath(base_path)
+    to_hash = []
+
+    for file in files:
+        key = os.path.join(base_path, file["path"])
+        fingerprint = lookup_fingerprint(cache, key, file["size"], file["mod_time"])
+        if fingerprint is not None:
+            file["fingerprint"] = fingerprint
+        else:
+            to_hash.append((key, file))
+
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [(key, file, pool.submit(hash_local_file, key)) for key, file in to_hash]
+            for key, file, future in futures:
+                try:
+                    file["fingerprint"] = future.result()
+                    store_fingerprint(cache, key, file["size"], file["mod_time"], file["fingerprint"])
+                except OSError as e:
+                    logger.warning("Failed to fingerprint '%s': %s", file["path"], e)
+
+    # Drop entries of files that no longer exist under this archive
+    prefix = base_path + os.sep
+    present = {os.path.join(base_path, f["path"]) for f in files}
+    for key in [k for k in cache if k.startswith(prefix) and k not in present]:
+        del cache[key]
+
+    try:
+        save_fingerprint_cache(FINGERPRINT_CACHE_FILE, cache)
+    except OSError as e:
+        logger.warning("Failed to save fingerprint cache: %s", e)
+
+    logger.info("Fingerprinted %d files (%d from cache)", len(files), len(files) - len(to_hash))
     return files
 
 
 def send_file(sock, archive_path, file_info):
     # Sends a file over the socket connection along with its metadata
+    # Returns the number of bytes sent, or None if the file could not be sent
     try:
         rel_path = file_info["path"]
         full_path = os.path.join(archive_path, rel_path)
@@ -52,11 +113,13 @@ def send_file(sock, archive_path, file_info):
                 if not chunk:
                     break
                 sock.sendall(chunk)  # May raise socket.error
-        print(f"[ARCHIVE UTILS] Sent file '{rel_path}' ({size} bytes)")
+        logger.debug("Sent file '%s' (%d bytes)", rel_path, size)
+        return size
 
     except (OSError, FileNotFoundError) as e:
         # Handle errors related to file access
-        print(f"[ARCHIVE UTILS] Failed to read or send file '{file_info.get('path')}': {e}")
+        logger.warning("Failed to read or send file '%s': %s", file_info.get("path"), e)
     except Exception as e:
         # Catch-all for socket or encoding-related issues
-        print(f"[ARCHIVE UTILS] Unexpected error while sending file: {e}")
+        logger.error("Unexpected error while sending file: %s", e)
+    return None
@@ -4,6 +4,9 @@ import json
 import threading
 from common.protocol import make_discover_message, MESSAGE_TYPES
 from common.utils import MULTICAST_GROUP, MULTICAST_PORT
+from common.logger import get_logger
+
+logger = get_logger("DISCOVERY")
 
 # Timeout for receiving OFFER response
 WAIT_FOR_OFFER_TIMEOUT = 5
@@ -35,7 +38,7 @@ def discovery_loop():
                 continue
 
             try:
-                print("[DISCOVERY] Sending DISCOVER message...")
+                logger.debug("Sending DISCOVER message...")
                 sock.sendto(discover_msg, (MULTICAST_GROUP, MULTICAST_PORT))
 
                 data, server = sock.recvfrom(1024)
@@ -45,27 +48,27 @@ def discovery_loop():
                     # Server responded with an OFFER message
                     discovered_server["host"] = server[0]
                     discovered_server["port"] = msg["port"]
-                    print(f"[DISCOVERY] Received OFFER from {server[0]}:{msg['port']}")
+                    logger.info("Received OFFER from %s:%s", server[0], msg["port"])
                     pause_event.set()
 
             except socket.timeout:
                 # No OFFER response received within timeout
-                print(f"[DISCOVERY] No OFFER received. Retrying in {RETRY_INTERVAL} seconds...")
+                logger.info("No OFFER received. Retrying in %d seconds...", RETRY_INTERVAL)
                 time.sleep(RETRY_INTERVAL)
 
             except (socket.error, json.JSONDecodeError) as e:
                 # Handle socket or JSON decoding errors
-                print(f"[DISCOVERY] Communication error: {e}")
+                logger.warning("Communication error: %s", e)
                 time.sleep(RETRY_INTERVAL)
 
             except Exception as e:
                 # Catch-all for unexpected errors
-                print(f"[DISCOVERY] Unexpected error: {e}")
+                logger.error("Unexpected error: %s", e)
                 time.sleep(RETRY_INTERVAL)
 
     except Exception as e:
         # Handle initialization failure (e.g., socket creation)
-        print(f"[DISCOVERY] Failed to initialize discovery socket: {e}")
+        logger.error("Failed to initialize discovery socket: %s", e)
 
 
 def start_discovery_thread():
@@ -74,7 +77,7 @@ def start_discovery_thread():
         thread = threading.Thread(target=discovery_loop, daemon=True)
         thread.start()
     except Exception as e:
-        print(f"[DISCOVERY] Failed to start discovery thread: {e}")
+        logger.error("Failed to start discovery thread: %s", e)
 
 
 def find_server():
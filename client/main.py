@@ -2,6 +2,13 @@ import os
 import sys
 from client.discovery import start_discovery_thread, stop_event
 from client.tcp_client import start_tcp_client
+from client.restore import start_restore
+from common.logger import setup_logging, get_logger
+
+# File receiving the client's structured (JSON lines) log output
+LOG_FILE = "client.log"
+
+logger = get_logger("CLIENT")
 
 
 def get_client_config():
@@ -24,20 +31,49 @@ def get_client_config():
     return client_id, archive_path
 
 
+def get_restore_config():
+    # Ask whether to restore the archive from the server instead of syncing to it
+    mode = input("Enter mode (sync/restore) [sync]: ").strip().lower()
+    while mode not in ("", "sync", "restore"):
+        print("Mode must be 'sync' or 'restore'.")
+        mode = input("Enter mode (sync/restore) [sync]: ").strip().lower()
+
+    if mode != "restore":
+        return None
+
+    # Empty input restores the full archive; otherwise files or directories, comma separated
+    paths = input("Enter paths to restore (comma separated, empty for everything): ")
+
+    # Snapshots are named by their UTC timestamp, e.g. 20260101T120000000000Z
+    snapshot = input("Enter snapshot to restore (empty for the current archive): ").strip()
+    return [p.strip() for p in paths.split(",") if p.strip()], snapshot or None
+
+
 if __name__ == "__main__":
     try:
         # Get user configuration (client ID and archive path)
         CLIENT_ID, ARCHIVE_PATH = get_client_config()
+        RESTORE_CONFIG = get_restore_config()
+
+        # Start the background log writer (console + log file)
+        setup_logging(LOG_FILE)
 
         # Start background discovery thread
         start_discovery_thread()
 
+        if RESTORE_CONFIG is not None:
+            # Download the archive (or the selected paths) back from the server, then exit
+            RESTORE_PATHS, RESTORE_SNAPSHOT = RESTORE_CONFIG
+            start_restore(ARCHIVE_PATH, CLIENT_ID, RESTORE_PATHS, RESTORE_SNAPSHOT)
+            stop_event.set()
+            sys.exit(0)
+
         # Start TCP file sync client
         start_tcp_client(ARCHIVE_PATH, CLIENT_ID)
 
     except KeyboardInterrupt:
         # Handle Ctrl+C interrupt for graceful shutdown
-        print("\n[CLIENT] Shutdown requested by user.")
+        logger.info("Shutdown requested by user.")
 
         # Signal the discovery thread to stop
         stop_event.set()
@@ -47,7 +83,7 @@ if __name__ == "__main__":
 
     except Exception as e:
         # Catch all unexpected errors
-        print(f"[CLIENT] Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
 
         # Make sure discovery thread is also terminated
         stop_event.set()
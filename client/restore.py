@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import shutil
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from common.protocol import MESSAGE_TYPES, make_restore_request_message
+from common.logger import get_logger
+from client.discovery import pause_event
+from client.archive_utils import get_local_file_index, RESTORE_STATE_DIR
+from client.tcp_client import (
+    connect_to_server,
+    handle_initial_server_message,
+    wait_before_reconnect,
+    ServerBusyError
+)
+
+logger = get_logger("RESTORE")
+
+# Journal of the files planned by the current restore, used to resume partial downloads
+RESTORE_JOURNAL = "journal.json"
+
+# Threads writing small restored files to disk while the socket keeps receiving
+RESTORE_WRITE_WORKERS = 4
+
+# Read size when streaming large files from the socket
+RESTORE_CHUNK_SIZE = 1024 * 1024
+
+# Received bundle data allowed to wait for the writer threads (a few bundles); the
+# socket is not read further until writes catch up, so memory stays bounded
+RESTORE_WRITE_BUFFER = 16 * 1024 * 1024
+
+
+def resolve_target(archive_path, rel_path):
+    # Maps a path sent by the server to a location inside the archive, rejecting escapes
+    base = os.path.abspath(archive_path)
+    target = os.path.abspath(os.path.join(base, rel_path))
+    if os.path.commonpath([base, target]) != base or target == base:
+        raise ValueError(f"Refusing to restore outside the archive: '{rel_path}'")
+    return target
+
+
+def load_journal(state_dir):
+    # Loads the journal left behind by an interrupted restore, if any
+    try:
+        with open(os.path.join(state_dir, RESTORE_JOURNAL), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_journal(state_dir, journal):
+    # Persists the planned files so partial downloads can be resumed later
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, RESTORE_JOURNAL), "w", encoding="utf-8") as f:
+        json.dump(journal, f)
+
+
+def collect_partials(state_dir, journal):
+    # Reports partially downloaded files so the server can continue from their current size
+    partial = []
+    for path, entry in journal.items():
+        part_path = os.path.join(state_dir, "parts", path)
+        try:
+            offset = os.path.getsize(part_path)
+        except OSError:
+            continue
+        if offset:
+            partial.append({"path": path, "offset": offset, "size": entry["size"], "mod_time": entry["mod_time"]})
+    return partial
+
+
+def finalize_file(archive_path, part_path, rel_path, mod_time):
+    # Moves a completely downloaded file into place with its original mtime
+    target = resolve_target(archive_path, rel_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.utime(part_path, (mod_time, mod_time))
+    os.replace(part_path, target)
+
+
+def write_small_file(archive_path, state_dir, entry, data):
+    # Writes one file received in a bundle (runs in the writer pool)
+    part_path = os.path.join(state_dir, "parts", entry["path"])
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    with open(part_path, "wb") as f:
+        f.write(data)
+    finalize_file(archive_path, part_path, entry["path"], entry["mod_time"])
+
+
+def read_exact(reader, size):
+    # Reads exactly size bytes from the socket or fails if the connection drops
+    data = reader.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection lost during restore.")
+    return data
+
+
+def read_json_line(reader):
+    # Reads one newline-terminated JSON message from the socket
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server.")
+    return json.loads(line.decode())
+
+
+def collect_writes(writes, limit):
+    # Takes finished writes off the front of the queue, raising their errors right away,
+    # and waits for the oldest ones while more than limit bytes are still queued.
+    # writes is {"pending": deque of (future, size), "bytes": queued bytes}.
+    pending = writes["pending"]
+    while pending and (pending[0][0].done() or writes["bytes"] > limit):
+        future, size = pending.popleft()
+        writes["bytes"] -= size
+        future.result()
+
+
+def receive_bundle(reader, pool, writes, archive_path, state_dir, header):
+    # Receives the files of a RESTORE_BUNDLE and hands them to the writer pool
+    for entry in header["files"]:
+        resolve_target(archive_path, entry["path"])
+        collect_writes(writes, RESTORE_WRITE_BUFFER - entry["size"])
+        data = read_exact(reader, entry["size"])
+        writes["pending"].append((pool.submit(write_small_file, archive_path, state_dir, entry, data), entry["size"]))
+        writes["bytes"] += entry["size"]
+
+
+def receive_single_file(reader, archive_path, state_dir, header):
+    # Receives a RESTORE_FILE, appending to the partial download when resuming
+    rel_path = header["path"]
+    resolve_target(archive_path, rel_path)
+    part_path = os.path.join(state_dir, "parts", rel_path)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+
+    offset = header.get("offset", 0)
+    remaining = header["size"] - offset
+    with open(part_path, "r+b" if offset else "wb") as f:
+        f.seek(offset)
+        f.truncate()
+        while remaining > 0:
+            chunk = read_exact(reader, min(RESTORE_CHUNK_SIZE, remaining))
+            f.write(chunk)
+            remaining -= len(chunk)
+
+    finalize_file(archive_path, part_path, rel_path, header["mod_time"])
+    return header["size"] - offset
+
+
+def restore_archive(archive_path, client_id, paths, snapshot=None):
+    # Requests the selected paths (as of snapshot, if given) from the server and writes them into the archive
+    state_dir = os.path.join(archive_path, RESTORE_STATE_DIR)
+    have = [{"path": f["path"], "size": f["size"], "mod_time": f["mod_time"]}
+            for f in get_local_file_index(archive_path)]
+    partial = collect_partials(state_dir, load_journal(state_dir))
+
+    started = time.monotonic()
+    received_files = 0
+    received_bytes = 0
+
+    try:
+        sock, host, port = connect_to_server()
+    except OSError as e:
+        # Unreachable host and similar failures are network problems worth retrying
+        raise ConnectionError(f"Failed to connect to server: {e}") from e
+
+    with sock:
+        pause_event.set()
+        handle_initial_server_message(sock)
+
+        request = make_restore_request_message(client_id, paths, have, partial, snapshot)
+        sock.sendall((json.dumps(request) + "\n").encode())
+        reader = sock.makefile("rb")
+
+        info = read_json_line(reader)
+        if info.get("type") == MESSAGE_TYPES["BUSY"]:
+            raise ConnectionError("Server is busy with another session of this client")
+        if info.get("type") != MESSAGE_TYPES["RESTORE_INFO"]:
+            raise Exception(f"Unexpected response type: {info.get('type')}")
+        if info.get("error"):
+            available = ", ".join(info.get("snapshots", [])) or "none"
+            raise ValueError(f"{info['error']} (available snapshots: {available})")
+
+        journal = {f["path"]: {"size": f["size"], "mod_time": f["mod_time"]} for f in info["files"]}
+        save_journal(state_dir, journal)
+        logger.info("Restoring %d files (%d bytes)%s", len(journal), info.get("total_bytes", 0),
+                    " - resuming partial downloads" if partial else "")
+
+        with ThreadPoolExecutor(max_workers=RESTORE_WRITE_WORKERS) as pool:
+            writes = {"pending": deque(), "bytes": 0}
+            while True:
+                msg = read_json_line(reader)
+                msg_type = msg.get("type")
+                if msg_type == MESSAGE_TYPES["RESTORE_BUNDLE"]:
+                    receive_bundle(reader, pool, writes, archive_path, state_dir, msg)
+                    received_files += len(msg["files"])
+                    received_bytes += sum(f["size"] for f in msg["files"])
+                elif msg_type == MESSAGE_TYPES["RESTORE_FILE"]:
+                    received_bytes += receive_single_file(reader, archive_path, state_dir, msg)
+                    received_files += 1
+                elif msg_type == MESSAGE_TYPES["RESTORE_DONE"]:
+                    break
+                else:
+                    raise Exception(f"Unexpected message during restore: {msg_type}")
+
+            collect_writes(writes, -1)  # Waits for every write, including empty files
+
+    shutil.rmtree(state_dir, ignore_errors=True)
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        "Restore summary: %d files (%d bytes) in %.2fs, %d failed on server",
+        received_files, received_bytes, elapsed, msg.get("failed_files", 0),
+        extra={"fields": {
+            "event": "restore_summary",
+            "received_files": received_files,
+            "received_bytes": received_bytes,
+            "failed_files": msg.get("failed_files", 0),
+            "elapsed_seconds": round(elapsed, 3),
+        }}
+    )
+
+
+def start_restore(archive_path, client_id, paths, snapshot=None):
+    # Runs the restore, resuming it after connection errors until it completes
+    while True:
+        try:
+            restore_archive(archive_path, client_id, paths, snapshot)
+            return
+
+        except ServerBusyError:
+            logger.info("Server worker is busy. Reconnecting...")
+            wait_before_reconnect()
+
+        except (ConnectionError, socket.timeout) as e:
+            # Only network failures are retried; the restore continues where it stopped
+            logger.warning("Connection error during restore: %s. Resuming in 5 seconds...", e)
+            pause_event.clear()
+            time.sleep(5)
+
+        except OSError as e:
+            # Local disk problems (no space, permissions, read-only target) will not heal by retrying
+            logger.error("Restore aborted by a local file error: %s", e)
+            raise
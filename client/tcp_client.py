@@ -1,17 +1,37 @@
 import socket
 import json
 import time
+import random
 from datetime import datetime, timedelta
 from common.protocol import MESSAGE_TYPES
 from client.discovery import find_server, pause_event
-from client.archive_utils import send_file, get_local_file_index
+from client.archive_utils import send_file, get_local_file_index, add_fingerprints
+from common.logger import get_logger
+
+logger = get_logger("CLIENT")
+
+# Send content fingerprints so the server can skip files whose mtime changed but content did not
+VERIFY_CONTENT = False
+
+# Longest random pause (seconds) before reconnecting when a busy server worker asks for it
+BUSY_RECONNECT_DELAY = 1.0
+
+
+class ServerBusyError(ConnectionError):
+    # Raised when a busy server worker closes the connection so the client reconnects
+    pass
+
+
+def wait_before_reconnect():
+    # Short jittered pause so clients redirected at the same time do not collide again
+    time.sleep(random.uniform(0.1, BUSY_RECONNECT_DELAY))
 
 
 def connect_to_server():
     # Attempt to discover the server's IP and port via multicast
-    print("===== LOOKING FOR NEW CONNECTION... =====")
+    logger.info("Looking for new connection...")
     server_host, server_port = find_server()
-    print(f"[CLIENT] Connecting to {server_host}:{server_port}...")
+    logger.info("Connecting to %s:%s...", server_host, server_port)
 
     # Create a new TCP socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -29,21 +49,27 @@ def handle_initial_server_message(sock):
     except json.JSONDecodeError:
         raise Exception("Invalid response from server.")
 
+    # A busy worker of a multi-process server closes the connection; another worker may be idle
+    if msg.get("type") == MESSAGE_TYPES["BUSY"] and msg.get("reconnect"):
+        raise ServerBusyError("Server worker is busy.")
+
     # If server is busy, wait until it sends READY
     if msg.get("type") == MESSAGE_TYPES["BUSY"]:
-        print("[CLIENT] Server is busy. Waiting for READY...")
+        logger.info("Server is busy. Waiting for READY...")
         while True:
             wait_msg = sock.recv(1024)
+            if not wait_msg:
+                raise ConnectionError("Connection closed while waiting for READY.")
             try:
                 ready_msg = json.loads(wait_msg.decode())
             except json.JSONDecodeError:
-                print("[CLIENT] Invalid message while waiting for READY.")
+                logger.warning("Invalid message while waiting for READY.")
                 continue
             if ready_msg.get("type") == MESSAGE_TYPES["READY"]:
-                print("[CLIENT] Received READY. Proceeding.")
+                logger.info("Received READY. Proceeding.")
                 break
     elif msg.get("type") == MESSAGE_TYPES["READY"]:
-        print("[CLIENT] Server is ready. Proceeding.")
+        logger.info("Server is ready. Proceeding.")
     else:
         raise Exception(f"Unexpected server message: {msg}")
 
@@ -51,15 +77,18 @@ def handle_initial_server_message(sock):
 def send_file_info(sock, archive_path, client_id):
     # Generate file metadata from the local archive
     file_info = get_local_file_index(archive_path)
+    if VERIFY_CONTENT:
+        add_fingerprints(archive_path, file_info)
 
     # Send metadata and client ID to the server
     payload = {
         "type": MESSAGE_TYPES["FILE_INFO"],
         "client_id": client_id,
-        "files": file_info
+        "files": file_info,
+        "verify": VERIFY_CONTENT
     }
     sock.send((json.dumps(payload) + "\n").encode())
-    print("[CLIENT] Sent file metadata.")
+    logger.info("Sent file metadata (%d files).", len(file_info))
     return file_info
 
 
@@ -67,28 +96,48 @@ def wait_for_next_sync(msg):
     # Wait for the time specified by the server before syncing again
     wait_time = int(msg.get("time_in_seconds", 60))
     wake_time = datetime.now() + timedelta(seconds=wait_time)
-    print(f"[CLIENT] Sleeping for {wait_time} seconds. Will wake at {wake_time.strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info("Sleeping for %d seconds. Will wake at %s", wait_time, wake_time.strftime("%Y-%m-%d %H:%M:%S"))
     time.sleep(wait_time)
 
 
 def upload_files(sock, archive_path, file_info, upload_list):
     # If there are no files to upload, skip this step
     if not upload_list:
-        print("[CLIENT] No files need to be uploaded.")
+        logger.info("No files need to be uploaded.")
         return
 
+    started = time.monotonic()
+    sent_files = 0
+    sent_bytes = 0
+
     # Loop through each file in the upload list
-    print("[CLIENT] Files to upload:")
+    logger.info("Uploading %d files...", len(upload_list))
     for file in upload_list:
-        print(f" - {file['path']}")
+        logger.debug("Uploading '%s'", file["path"])
         # Find the file metadata in the local index
         match = next((f for f in file_info if f["path"] == file["path"]), None)
         if match:
             try:
                 # Send the file over the socket
-                send_file(sock, archive_path, match)
+                size = send_file(sock, archive_path, match)
+                if size is not None:
+                    sent_files += 1
+                    sent_bytes += size
             except Exception as e:
-                print(f"[CLIENT] Failed to send file {match['path']}: {e}")
+                logger.warning("Failed to send file %s: %s", match["path"], e)
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        "Upload summary: %d/%d files sent (%d bytes), %d failed, %.2fs",
+        sent_files, len(upload_list), sent_bytes, len(upload_list) - sent_files, elapsed,
+        extra={"fields": {
+            "event": "upload_summary",
+            "requested_files": len(upload_list),
+            "sent_files": sent_files,
+            "sent_bytes": sent_bytes,
+            "elapsed_seconds": round(elapsed, 3),
+        }}
+    )
 
 
 def handle_sync_response(sock, archive_path, client_id, file_info):
@@ -101,10 +150,14 @@ def handle_sync_response(sock, archive_path, client_id, file_info):
 
     # If no files need syncing, sleep until the next scheduled sync
     if msg.get("type") == MESSAGE_TYPES["NEXT_SYNC"]:
-        print("[CLIENT] No files require sync...")
+        logger.info("No files require sync...")
         wait_for_next_sync(msg)
         return
 
+    # Another server worker is still serving this client (e.g. a restore); retry later
+    elif msg.get("type") == MESSAGE_TYPES["BUSY"]:
+        raise ConnectionError("Server is busy with another session of this client")
+
     # If files need to be uploaded
     elif msg.get("type") == MESSAGE_TYPES["ARCHIVE_TASKS"]:
         upload_list = msg.get("upload", [])
@@ -146,14 +199,18 @@ def start_tcp_client(archive_path, client_id):
                 # Handle the server's response to the metadata (e.g. files to upload)
                 handle_sync_response(sock, archive_path, client_id, file_info)
 
+        except ServerBusyError:
+            logger.info("Server worker is busy. Reconnecting...")
+            wait_before_reconnect()
+
         except (socket.error, ConnectionError) as e:
-            # Connection-related error: print and retry after short pause
-            print(f"[CLIENT] Connection error: {e}. Retrying in 5 seconds...")
+            # Connection-related error: log and retry after short pause
+            logger.warning("Connection error: %s. Retrying in 5 seconds...", e)
             pause_event.clear()  # Allow discovery to resume
             time.sleep(5)
 
         except Exception as e:
             # Other unexpected errors: log and retry
-            print(f"[CLIENT] Unexpected error: {e}. Retrying in 5 seconds...")
+            logger.error("Unexpected error: %s. Retrying in 5 seconds...", e)
             pause_event.clear()
             time.sleep(5)
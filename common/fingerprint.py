@@ -0,0 +1,52 @@
+import os
+import json
+import hashlib
+
+# Read size while hashing file contents
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+# Two mtimes closer than this are treated as equal when matching cache entries
+MTIME_TOLERANCE = 0.001
+
+
+def compute_fingerprint(f):
+    # Returns a 128-bit BLAKE2b hex digest of an open binary file's contents
+    digest = hashlib.blake2b(digest_size=16)
+    while True:
+        chunk = f.read(FINGERPRINT_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_fingerprint_cache(cache_file):
+    # Loads a {key: [size, mod_time, fingerprint]} cache; a missing or broken file is an empty cache
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_fingerprint_cache(cache_file, cache):
+    # Writes the cache atomically so a crash never leaves it half written
+    directory = os.path.dirname(cache_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, cache_file)
+
+
+def lookup_fingerprint(cache, key, size, mod_time):
+    # Returns the cached fingerprint if it was computed for the same size and mtime
+    cached = cache.get(key)
+    if cached and cached[0] == size and abs(cached[1] - mod_time) < MTIME_TOLERANCE:
+        return cached[2]
+    return None
+
+
+def store_fingerprint(cache, key, size, mod_time, fingerprint):
+    cache[key] = [size, mod_time, fingerprint]
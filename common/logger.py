@@ -0,0 +1,186 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Console output format (human readable, mirrors the old "[COMPONENT] message" prints)
+CONSOLE_FORMAT = "%(asctime)s %(levelname)-7s [%(name)s] %(message)s"
+
+# Repeated warnings/errors with the same template are allowed this many times per window...
+RATE_LIMIT_BURST = 5
+
+# ...and the window length in seconds
+RATE_LIMIT_INTERVAL = 60
+
+# Background listener draining the log queue (None until setup_logging is called)
+_listener = None
+
+# Handler and filter feeding the queue, kept to report suppressed counts
+_queue_handler = None
+_rate_limit_filter = None
+
+# Stops the thread that periodically reports suppressed counts
+_flush_stop = threading.Event()
+
+
+class JsonLineFormatter(logging.Formatter):
+    # Formats each record as a single JSON object per line for the log files
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "component": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        exception = getattr(record, "exception", None)
+        if exception:
+            entry["exception"] = exception
+        return json.dumps(entry)
+
+
+class ConsoleFormatter(logging.Formatter):
+    # Human readable lines; the traceback captured before queueing goes on the following lines
+    def format(self, record):
+        line = super().format(record)
+        exception = getattr(record, "exception", None)
+        return f"{line}\n{exception}" if exception else line
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    # Like QueueHandler, but keeps the traceback in a separate "exception" attribute
+    # instead of folding it into the message, so the JSON log gets its own field
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exception = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    # Drops repeated WARNING+ records sharing the same logger and message template.
+    # Suppressed counts are reported by the next matching record after the window,
+    # or by flush() once the window has expired (and on shutdown).
+    def __init__(self, burst=RATE_LIMIT_BURST, interval=RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or getattr(record, "suppression_report", False):
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+
+        with self._lock:
+            window_start, count, suppressed, last = self._windows.get(key, (now, 0, 0, None))
+            if now - window_start >= self.interval:
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+                window_start, count, suppressed = now, 0, 0
+
+            if count < self.burst:
+                self._windows[key] = (window_start, count + 1, suppressed, None)
+                return True
+
+            self._windows[key] = (window_start, count, suppressed + 1, record)
+            return False
+
+    def flush(self, force=False):
+        # Returns report records for windows that ended with suppressed messages
+        now = time.monotonic()
+        reports = []
+        with self._lock:
+            for key, (window_start, count, suppressed, last) in list(self._windows.items()):
+                if not force and now - window_start < self.interval:
+                    continue
+                del self._windows[key]
+                if suppressed:
+                    report = copy.copy(last)
+                    report.msg = f"{last.getMessage()} ({suppressed} similar messages suppressed)"
+                    report.args = None
+                    report.exc_info = None
+                    report.suppression_report = True
+                    reports.append(report)
+        return reports
+
+
+def get_logger(component):
+    # Returns the logger for a component, e.g. get_logger("TCP SERVER")
+    return logging.getLogger(component)
+
+
+def setup_logging(log_file, level=logging.INFO, console_level=logging.INFO):
+    # Routes all logging through a queue drained by a background thread, which
+    # writes human readable lines to the console and JSON lines to log_file
+    global _listener, _queue_handler, _rate_limit_filter
+
+    if _listener is not None:
+        return
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(ConsoleFormatter(CONSOLE_FORMAT, "%H:%M:%S"))
+
+    handlers = [console_handler]
+    try:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setLevel(level)
+        file_handler.setFormatter(JsonLineFormatter())
+        handlers.append(file_handler)
+    except OSError as e:
+        print(f"[LOGGER] Failed to open log file '{log_file}': {e}")
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = StructuredQueueHandler(log_queue)
+    _rate_limit_filter = RateLimitFilter()
+    _queue_handler.addFilter(_rate_limit_filter)
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(_queue_handler)
+    root.setLevel(min(level, console_level))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _flush_stop.clear()
+    threading.Thread(target=suppression_flush_loop, daemon=True).start()
+    atexit.register(shutdown_logging)
+
+
+def flush_suppressed(force=False):
+    # Logs the counts of messages dropped by the rate limiter in finished windows
+    if _rate_limit_filter is None:
+        return
+    for report in _rate_limit_filter.flush(force):
+        _queue_handler.handle(report)
+
+
+def suppression_flush_loop():
+    # Reports suppressed counts even when the repeated message stops arriving
+    while not _flush_stop.wait(RATE_LIMIT_INTERVAL):
+        flush_suppressed()
+
+
+def shutdown_logging():
+    # Flushes pending records and stops the background writer
+    global _listener
+
+    if _listener is not None:
+        _flush_stop.set()
+        flush_suppressed(force=True)
+        _listener.stop()
+        _listener = None
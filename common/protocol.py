@@ -8,7 +8,12 @@ MESSAGE_TYPES = {
     "ARCHIVE_LIST": "ARCHIVE_LIST",
     "ARCHIVE_TASKS": "ARCHIVE_TASKS",
     "FILE_TRANSFER": "FILE_TRANSFER",
-    "NEXT_SYNC": "NEXT_SYNC"
+    "NEXT_SYNC": "NEXT_SYNC",
+    "RESTORE_REQUEST": "RESTORE_REQUEST",
+    "RESTORE_INFO": "RESTORE_INFO",
+    "RESTORE_FILE": "RESTORE_FILE",
+    "RESTORE_BUNDLE": "RESTORE_BUNDLE",
+    "RESTORE_DONE": "RESTORE_DONE"
 }
 
 # simple message functions
@@ -32,3 +37,17 @@ def make_next_sync_message(time_in_seconds_str: str):
         "type": MESSAGE_TYPES["NEXT_SYNC"],
         "time_in_seconds": time_in_seconds_str
     }
+
+
+def make_restore_request_message(client_id: str, paths: list, have: list, partial: list, snapshot: str = None):
+    message = {
+        "type": MESSAGE_TYPES["RESTORE_REQUEST"],
+        "client_id": client_id,
+        "paths": paths,
+        "have": have,
+        "partial": partial
+    }
+    # Restores the archive as it was at a server-side snapshot instead of its current state
+    if snapshot:
+        message["snapshot"] = snapshot
+    return message
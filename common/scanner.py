@@ -0,0 +1,114 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from common.logger import get_logger
+
+logger = get_logger("SCANNER")
+
+# Threads listing directories and calling stat, shared by client and server scans;
+# raise for NFS/SMB storage, 1 scans sequentially
+SCAN_WORKERS = 8
+
+# Number of stat calls grouped into a single pool task; small enough that the
+# files of ordinary directories are spread over several threads
+STAT_BATCH_SIZE = 16
+
+# Stat batches submitted ahead of the one being yielded, across directories;
+# bounds the results held in memory while keeping every thread busy
+SCAN_LOOKAHEAD_BATCHES = 256
+
+
+def list_directory(path):
+    # Returns the sorted file and subdirectory names of a single directory
+    files = []
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    # Like os.walk, symlinked directories are not descended into
+                    if not entry.is_symlink():
+                        dirs.append(entry.name)
+                    continue
+            except OSError:
+                pass
+            files.append(entry.name)
+    return sorted(files), sorted(dirs)
+
+
+def stat_files(directory, names):
+    # Stats a batch of files, keeping per-file errors instead of failing the batch
+    results = []
+    for name in names:
+        try:
+            results.append((name, os.stat(os.path.join(directory, name)), None))
+        except OSError as e:
+            results.append((name, None, e))
+    return results
+
+
+def run_inline(fn, *args):
+    # Runs fn immediately and wraps the outcome in a Future (sequential mode)
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def plan_directories(base_path, submit, skip_dirs):
+    # Walks the tree in pre-order as directory listings complete. Each directory's
+    # stat batches are submitted as soon as its listing is known, and its
+    # subdirectories start listing at once. Yields (rel_dir, stat batch futures).
+    stack = [("", submit(list_directory, base_path))]
+    while stack:
+        rel_dir, listing = stack.pop()
+        directory = os.path.join(base_path, rel_dir) if rel_dir else base_path
+        try:
+            files, dirs = listing.result()
+        except OSError as e:
+            logger.warning("Failed to list directory '%s': %s", directory, e)
+            continue
+
+        children = []
+        for name in dirs:
+            if not rel_dir and name in skip_dirs:
+                continue
+            child = f"{rel_dir}/{name}" if rel_dir else name
+            children.append((child, submit(list_directory, os.path.join(directory, name))))
+        stack.extend(reversed(children))
+
+        yield rel_dir, [submit(stat_files, directory, files[i:i + STAT_BATCH_SIZE])
+                        for i in range(0, len(files), STAT_BATCH_SIZE)]
+
+
+def scan_tree(base_path, workers=SCAN_WORKERS, skip_dirs=()):
+    # Yields (rel_path, filename, stat_result, error) for every file below base_path.
+    # Directory listings and stat calls run on a bounded thread pool, with stat
+    # batches of up to SCAN_LOOKAHEAD_BATCHES following directories in flight, but
+    # results are always yielded in the same order: sorted, directory by directory
+    # (pre-order). skip_dirs names top-level directories that are left out of the scan.
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    submit = pool.submit if pool else run_inline
+
+    def drain(pending):
+        rel_dir, batches = pending.popleft()
+        for batch in batches:
+            for name, st, error in batch.result():
+                yield (f"{rel_dir}/{name}" if rel_dir else name), name, st, error
+
+    try:
+        pending = deque()
+        in_flight = 0
+        for rel_dir, batches in plan_directories(base_path, submit, skip_dirs):
+            pending.append((rel_dir, batches))
+            in_flight += len(batches)
+            while in_flight > SCAN_LOOKAHEAD_BATCHES:
+                in_flight -= len(pending[0][1])
+                yield from drain(pending)
+        while pending:
+            yield from drain(pending)
+    finally:
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -1,17 +1,58 @@
+import io
 import os
+import time
+import tempfile
+from collections import deque
+from common.logger import get_logger
+from common.scanner import scan_tree, SCAN_WORKERS
+from common.fingerprint import (
+    compute_fingerprint,
+    load_fingerprint_cache,
+    save_fingerprint_cache,
+    lookup_fingerprint,
+    store_fingerprint
+)
+from server.pack_storage import (
+    has_pack_storage,
+    is_packed,
+    get_packed_index,
+    write_packed_file,
+    read_packed_file,
+    touch_packed_file,
+    rename_packed_file,
+    delete_packed_file,
+    compact_packs
+)
+from server import snapshots
+
+logger = get_logger("ARCHIVE HANDLER")
 
 # Root directory where all client archives are stored
 ARCHIVES_ROOT = "archives"
 
+# Storage backend for new files: "files" keeps one file per archived file,
+# "pack" appends files up to PACK_FILE_LIMIT bytes into per-client pack files
+STORAGE_BACKEND = "files"
+
+# Largest file stored inside a pack; bigger files are always kept as plain files
+PACK_FILE_LIMIT = 1024 * 1024
+
+# Per-client caches of stored file fingerprints ({path: [size, mod_time, fingerprint]})
+FINGERPRINTS_ROOT = "fingerprints"
+
+# mkstemp creates files readable by the owner only; archived files get the umask-based mode instead
+_umask = os.umask(0)
+os.umask(_umask)
+
 
 def ensure_archives_dir_exists():
     # Ensure the root directory for archives exists; create it if necessary
     try:
         if not os.path.exists(ARCHIVES_ROOT):
             os.makedirs(ARCHIVES_ROOT)
-            print(f"[ARCHIVE HANDLER] Created root archive directory: {ARCHIVES_ROOT}")
+            logger.info("Created root archive directory: %s", ARCHIVES_ROOT)
     except Exception as e:
-        print(f"[ARCHIVE HANDLER] Failed to create root archive directory: {e}")
+        logger.error("Failed to create root archive directory: %s", e)
 
 
 def ensure_client_archive_dir(client_id):
@@ -22,9 +63,9 @@ def ensure_client_archive_dir(client_id):
     try:
         if not os.path.exists(client_dir):
             os.makedirs(client_dir)
-            print(f"[ARCHIVE HANDLER] Created archive directory for client: {client_id}")
+            logger.info("Created archive directory for client: %s", client_id)
     except Exception as e:
-        print(f"[ARCHIVE HANDLER] Failed to create client archive directory '{client_id}': {e}")
+        logger.error("Failed to create client archive directory '%s': %s", client_id, e)
 
     return client_dir
 
@@ -35,17 +76,16 @@ def get_server_file_index(client_id):
     try:
         client_dir = ensure_client_archive_dir(client_id)
 
-        for root, _, files in os.walk(client_dir):
-            for file in files:
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, client_dir).replace("\\", "/")
-                try:
-                    mod_time = os.path.getmtime(full_path)
-                    index.append({"path": rel_path, "mod_time": mod_time})
-                except Exception as e:
-                    print(f"[ARCHIVE HANDLER] Failed to read modification time for '{rel_path}': {e}")
+        for rel_path, _, st, error in scan_tree(client_dir, SCAN_WORKERS):
+            if error:
+                logger.warning("Failed to read modification time for '%s': %s", rel_path, error)
+                continue
+            index.append({"path": rel_path, "mod_time": st.st_mtime, "size": st.st_size})
+
+        if has_pack_storage(client_id):
+            index.extend(get_packed_index(client_id))
     except Exception as e:
-        print(f"[ARCHIVE HANDLER] Failed to build server file index for '{client_id}': {e}")
+        logger.error("Failed to build server file index for '%s': %s", client_id, e)
 
     return index
 
@@ -66,28 +106,267 @@ def compare_file_indexes(server_index, client_index):
 
         to_delete = [path for path in server_dict if path not in client_paths]
     except Exception as e:
-        print(f"[ARCHIVE HANDLER] Failed to compare file indexes: {e}")
+        logger.error("Failed to compare file indexes: %s", e)
 
     return to_upload, to_delete
 
 
+def fingerprint_cache_file(client_id):
+    return os.path.join(FINGERPRINTS_ROOT, client_id + ".json")
+
+
+def get_stored_fingerprint(client_id, cache, entry):
+    # Returns the fingerprint of a stored file, hashing it only on a cache miss
+    fingerprint = lookup_fingerprint(cache, entry["path"], entry["size"], entry["mod_time"])
+    if fingerprint is None:
+        with open_archived_file(client_id, entry["path"]) as f:
+            fingerprint = compute_fingerprint(f)
+        store_fingerprint(cache, entry["path"], entry["size"], entry["mod_time"], fingerprint)
+    return fingerprint
+
+
+def filter_unchanged_files(client_id, server_index, client_files, to_upload):
+    # Splits to_upload into files whose content really changed and files where only
+    # the mtime moved: same size and same fingerprint as the stored copy.
+    # client_files maps path -> client index entry (with "size" and "fingerprint").
+    server_dict = {f["path"]: f for f in server_index}
+    cache_file = fingerprint_cache_file(client_id)
+    cache = load_fingerprint_cache(cache_file)
+    changed = []
+    unchanged = []
+
+    for path in to_upload:
+        server_entry = server_dict.get(path)
+        client_entry = client_files.get(path, {})
+        fingerprint = client_entry.get("fingerprint")
+
+        # Size is checked first; only same-sized files are worth hashing
+        if server_entry is None or fingerprint is None or client_entry.get("size") != server_entry["size"]:
+            changed.append(path)
+            continue
+
+        try:
+            stored = get_stored_fingerprint(client_id, cache, server_entry)
+        except Exception as e:
+            logger.warning("Failed to fingerprint stored file '%s': %s", path, e)
+            changed.append(path)
+            continue
+
+        if stored == fingerprint:
+            # Cached under the client's mtime, which the stored copy is about to get
+            store_fingerprint(cache, path, server_entry["size"], client_entry["mod_time"], stored)
+            unchanged.append(path)
+        else:
+            changed.append(path)
+
+    try:
+        save_fingerprint_cache(cache_file, cache)
+    except OSError as e:
+        logger.warning("Failed to save fingerprint cache for '%s': %s", client_id, e)
+
+    return changed, unchanged
+
+
+def move_key(entry):
+    # Groups files that are indistinguishable without a fingerprint: same size and mtime
+    return entry["size"], round(entry["mod_time"], 3)
+
+
+def find_stored_copy(client_id, cache, bucket, client_entry):
+    # Finds a stored file in the bucket with the client's fingerprint and takes it out of
+    # the bucket. Stored files are hashed only as far as needed, each at most once.
+    # bucket is {"unhashed": deque of index entries, "hashed": {fingerprint: [entries]}}.
+    fingerprint = client_entry["fingerprint"]
+    candidates = bucket["hashed"].setdefault(fingerprint, [])
+    while True:
+        for entry in candidates:
+            if abs(entry["mod_time"] - client_entry["mod_time"]) <= 1:
+                candidates.remove(entry)
+                return entry
+        if not bucket["unhashed"]:
+            return None
+
+        entry = bucket["unhashed"].popleft()
+        try:
+            stored = get_stored_fingerprint(client_id, cache, entry)
+        except Exception as e:
+            logger.warning("Failed to fingerprint stored file '%s': %s", entry["path"], e)
+            continue
+        bucket["hashed"].setdefault(stored, []).append(entry)
+
+
+def detect_moves(client_id, server_index, client_files, to_upload, to_delete):
+    # Pairs new client paths with stored paths about to be deleted that hold the same
+    # file. With a fingerprint, the size must match, the mtime must be within 1s and the
+    # stored content must hash the same. Without one, a pair is trusted only when it is
+    # the single deleted and the single new file of its (size, mtime) group.
+    # Returns a list of (old_path, new_path) that can be renamed instead of re-uploaded.
+    server_dict = {f["path"]: f for f in server_index}
+    deleted = [server_dict[path] for path in sorted(to_delete) if path in server_dict]
+    added = [client_files[path] for path in sorted(to_upload)
+             if path not in server_dict and "size" in client_files.get(path, {})]
+    if not deleted or not added:
+        return []
+
+    cache_file = fingerprint_cache_file(client_id)
+    cache = load_fingerprint_cache(cache_file)
+    used = set()
+    moves = []
+
+    # Candidates are bucketed by size and whole second, so each new file only looks at
+    # stored files of its size whose mtime is within 1s
+    buckets = {}
+    for entry in deleted:
+        key = (entry["size"], entry["mod_time"] // 1)
+        buckets.setdefault(key, {"unhashed": deque(), "hashed": {}})["unhashed"].append(entry)
+
+    for client_entry in added:
+        if client_entry.get("fingerprint") is None:
+            continue
+        second = client_entry["mod_time"] // 1
+        for offset in (0, -1, 1):
+            bucket = buckets.get((client_entry["size"], second + offset))
+            match = bucket and find_stored_copy(client_id, cache, bucket, client_entry)
+            if match:
+                used.add(match["path"])
+                moves.append((match["path"], client_entry["path"]))
+                break
+
+    deleted_groups = {}
+    for entry in deleted:
+        if entry["path"] not in used:
+            deleted_groups.setdefault(move_key(entry), []).append(entry)
+    added_groups = {}
+    for client_entry in added:
+        if "fingerprint" not in client_entry:
+            added_groups.setdefault(move_key(client_entry), []).append(client_entry)
+    for key, group in added_groups.items():
+        candidates = deleted_groups.get(key, [])
+        if len(group) == 1 and len(candidates) == 1:
+            moves.append((candidates[0]["path"], group[0]["path"]))
+
+    # The moved file gets the client's mtime, so its cached fingerprint is re-keyed to it
+    for old_path, new_path in moves:
+        cached = cache.pop(old_path, None)
+        if cached:
+            store_fingerprint(cache, new_path, cached[0], client_files[new_path]["mod_time"], cached[2])
+
+    try:
+        save_fingerprint_cache(cache_file, cache)
+    except OSError as e:
+        logger.warning("Failed to save fingerprint cache for '%s': %s", client_id, e)
+
+    return moves
+
+
+def prune_fingerprint_cache(client_id, live_paths):
+    # Drops cached fingerprints of paths that are no longer archived (deleted or moved away)
+    cache_file = fingerprint_cache_file(client_id)
+    cache = load_fingerprint_cache(cache_file)
+    stale = [key for key in cache if key not in live_paths]
+    if not stale:
+        return
+
+    for key in stale:
+        del cache[key]
+    try:
+        save_fingerprint_cache(cache_file, cache)
+    except OSError as e:
+        logger.warning("Failed to save fingerprint cache for '%s': %s", client_id, e)
+
+
 def save_file_stream(client_id, path, data, mod_time=None):
     # Save incoming file data to disk under the client's archive path
     try:
         client_dir = ensure_client_archive_dir(client_id)
         full_path = os.path.join(client_dir, path)
+        snapshots.preserve_current_version(client_id, path, full_path)
+
+        if STORAGE_BACKEND == "pack" and len(data) <= PACK_FILE_LIMIT:
+            write_packed_file(client_id, path, data, mod_time if mod_time is not None else time.time())
+            # The file may previously have been stored as a plain file
+            if os.path.exists(full_path):
+                os.remove(full_path)
+            return
+
+        # The file may previously have been small enough to live in a pack
+        delete_packed_file(client_id, path)
 
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
 
-        with open(full_path, "wb") as f:
-            f.write(data)
+        # Written to a new file and swapped in, so snapshots hardlinked to the
+        # previous version keep their copy (copy-on-write)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix=".filesync-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o666 & ~_umask)
+
+            # Optionally restore the file's modification time
+            if mod_time is not None:
+                try:
+                    os.utime(tmp_path, (mod_time, mod_time))
+                except Exception as e:
+                    logger.warning("Failed to set mtime for '%s': %s", path, e)
+
+            os.replace(tmp_path, full_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    except Exception as e:
+        logger.error("Failed to save file stream for '%s': %s", path, e)
+
 
-        # Optionally restore the file's modification time
-        if mod_time is not None:
-            try:
-                os.utime(full_path, (mod_time, mod_time))
-                # print(f"[ARCHIVE HANDLER] Restored mtime for '{path}': {time.ctime(mod_time)}")
-            except Exception as e:
-                print(f"[ARCHIVE HANDLER] Failed to set mtime for '{path}': {e}")
+def open_archived_file(client_id, path):
+    # Open a stored file of the client's archive for binary reading
+    if is_packed(client_id, path):
+        return io.BytesIO(read_packed_file(client_id, path))
+    client_dir = os.path.join(ARCHIVES_ROOT, client_id)
+    return open(os.path.join(client_dir, path), "rb")
+
+
+def touch_archived_file(client_id, path, mod_time):
+    # Set the stored modification time of an archived file, leaving its content untouched.
+    # A snapshot sharing the inode keeps the old mtime in its manifest, so no copy is needed.
+    full_path = os.path.join(ARCHIVES_ROOT, client_id, path)
+    snapshots.preserve_current_version(client_id, path, full_path)
+
+    if is_packed(client_id, path):
+        touch_packed_file(client_id, path, mod_time)
+        return
+    os.utime(full_path, (mod_time, mod_time))
+
+
+def move_archived_file(client_id, old_path, new_path):
+    # Rename a stored file inside the client's archive without copying its data
+    client_dir = os.path.join(ARCHIVES_ROOT, client_id)
+    snapshots.preserve_current_version(client_id, old_path, os.path.join(client_dir, old_path))
+    snapshots.preserve_current_version(client_id, new_path, os.path.join(client_dir, new_path))
+
+    if is_packed(client_id, old_path):
+        rename_packed_file(client_id, old_path, new_path)
+        return
+
+    new_full_path = os.path.join(client_dir, new_path)
+    os.makedirs(os.path.dirname(new_full_path), exist_ok=True)
+    os.replace(os.path.join(client_dir, old_path), new_full_path)
+
+
+def delete_archived_file(client_id, path):
+    # Remove a file from the client's archive, wherever it is stored; returns True if it existed
+    full_path = os.path.join(ARCHIVES_ROOT, client_id, path)
+    snapshots.preserve_current_version(client_id, path, full_path)
+
+    deleted = delete_packed_file(client_id, path)
+    if os.path.exists(full_path):
+        os.remove(full_path)
+        deleted = True
+    return deleted
+
+
+def compact_client_storage(client_id):
+    # Reclaim space left in pack files by deleted or overwritten files
+    try:
+        compact_packs(client_id)
     except Exception as e:
-        print(f"[ARCHIVE HANDLER] Failed to save file stream for '{path}': {e}")
+        logger.error("Failed to compact pack storage for '%s': %s", client_id, e)
@@ -0,0 +1,42 @@
+import os
+from common.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no SO_REUSEPORT either, so only one process serves clients
+    fcntl = None
+
+logger = get_logger("LEASES")
+
+# Directory holding one lock file per client; a session holds its client's lock
+# so two worker processes never sync, restore or compact the same archive at once
+LEASES_ROOT = "leases"
+
+
+def acquire_client_lease(client_id):
+    # Takes the client's lease without waiting; returns a handle, or None if another
+    # session (in any worker process) holds it. The OS drops the lock if the holder dies.
+    if fcntl is None:
+        return True
+
+    os.makedirs(LEASES_ROOT, exist_ok=True)
+    lease = open(os.path.join(LEASES_ROOT, client_id + ".lock"), "a")
+    try:
+        fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lease.close()
+        return None
+    except Exception:
+        lease.close()
+        raise
+    return lease
+
+
+def release_client_lease(lease):
+    # Releases a lease returned by acquire_client_lease
+    if fcntl is None or lease is None:
+        return
+    try:
+        fcntl.flock(lease, fcntl.LOCK_UN)
+    finally:
+        lease.close()
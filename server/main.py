@@ -1,9 +1,26 @@
+import os
 import time
 import threading
 import signal
 import sys
 from server.udp_discovery import start_udp_discovery_server
 from server.tcp_server import start_tcp_server
+from server.workers import (
+    reuse_port_supported,
+    create_shared_state,
+    read_metrics,
+    start_worker_processes,
+    supervise_workers
+)
+from common.logger import setup_logging, get_logger
+
+# File receiving the server's structured (JSON lines) log output
+LOG_FILE = "server.log"
+
+logger = get_logger("SERVER")
+
+# How often (seconds) the parent logs counters aggregated over all worker processes
+METRICS_LOG_INTERVAL = 60
 
 # Global variable to store the main loop control state
 stop_event = threading.Event()
@@ -25,12 +42,18 @@ def get_server_config():
             break
         print("Invalid interval. Please enter a positive integer.")
 
-    return port, int(sync_input)
+    while True:
+        workers_input = input(f"Enter number of worker processes ({os.cpu_count()} CPU cores) [1]: ").strip() or "1"
+        if workers_input.isdigit() and int(workers_input) > 0:
+            break
+        print("Invalid number. Please enter a positive integer.")
+
+    return port, int(sync_input), int(workers_input)
 
 
 def shutdown_handler(signum, frame):
     # Handle graceful shutdown on SIGINT or SIGTERM
-    print("\n[SERVER] Shutdown requested by user...")
+    logger.info("Shutdown requested by user...")
     stop_event.set()
     sys.exit(0)
 
@@ -41,20 +64,53 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, shutdown_handler)
 
     try:
-        TCP_PORT, SYNC_INTERVAL_SECONDS = get_server_config()
+        TCP_PORT, SYNC_INTERVAL_SECONDS, WORKER_PROCESSES = get_server_config()
+
+        # Start the background log writer (console + log file)
+        setup_logging(LOG_FILE)
 
-        # Start UDP and TCP servers
+        if WORKER_PROCESSES > 1 and not reuse_port_supported():
+            logger.warning("SO_REUSEPORT is not available on this platform. Running a single process.")
+            WORKER_PROCESSES = 1
+
+        # A single UDP discovery responder serves all workers
         start_udp_discovery_server(TCP_PORT)
-        start_tcp_server(port=TCP_PORT, sync_interval_seconds=SYNC_INTERVAL_SECONDS)
 
-        print("[SERVER] USP Server is running...")
-        print(f"[SERVER] TCP Port: {TCP_PORT}")
-        print(f"[SERVER] Sync Interval: {SYNC_INTERVAL_SECONDS} seconds")
+        shared_state = None
+        workers = {}
+        if WORKER_PROCESSES > 1:
+            # Worker processes accept on the same TCP port; the kernel balances connections
+            shared_state = create_shared_state()
+            workers = start_worker_processes(WORKER_PROCESSES, TCP_PORT, SYNC_INTERVAL_SECONDS, shared_state)
+        elif not start_tcp_server(port=TCP_PORT, sync_interval_seconds=SYNC_INTERVAL_SECONDS):
+            raise RuntimeError(f"Cannot listen on TCP port {TCP_PORT}")
+
+        logger.info("USP Server is running...")
+        logger.info("TCP Port: %d", TCP_PORT)
+        logger.info("Sync Interval: %d seconds", SYNC_INTERVAL_SECONDS)
+        logger.info("Worker processes: %d", WORKER_PROCESSES)
 
-        # Keep main thread alive until interrupted
+        # Keep main thread alive until interrupted, reporting worker totals periodically
+        last_report = time.monotonic()
+        last_metrics = None
         while not stop_event.is_set():
             time.sleep(1)
+            if workers and not supervise_workers(workers, TCP_PORT, SYNC_INTERVAL_SECONDS, shared_state):
+                raise RuntimeError("Worker processes cannot be kept running")
+            if shared_state and time.monotonic() - last_report >= METRICS_LOG_INTERVAL:
+                last_report = time.monotonic()
+                metrics = read_metrics(shared_state["metrics"])
+                if metrics != last_metrics:
+                    logger.info(
+                        "Workers: %d active sessions, %d completed, %d files (%d bytes) received, "
+                        "%d files (%d bytes) restored",
+                        metrics["active_sessions"], metrics["completed_sessions"],
+                        metrics["received_files"], metrics["received_bytes"],
+                        metrics["restored_files"], metrics["restored_bytes"],
+                        extra={"fields": {"event": "worker_metrics", **metrics}}
+                    )
+                    last_metrics = metrics
 
     except Exception as e:
-        print(f"[SERVER] Critical error: {e}")
+        logger.critical("Critical error: %s", e)
         sys.exit(1)
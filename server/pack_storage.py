@@ -0,0 +1,299 @@
+import os
+import json
+import threading
+from common.logger import get_logger
+
+logger = get_logger("PACK STORAGE")
+
+# Root directory holding the pack files and indexes of every client
+PACKS_ROOT = "packs"
+
+# A pack stops receiving new files once it reaches this size
+PACK_MAX_BYTES = 256 * 1024 * 1024
+
+# Packs whose share of deleted/overwritten bytes exceeds this ratio are compacted
+COMPACT_DEAD_RATIO = 0.5
+
+# Append-only log of index changes ("put"/"del" records, one JSON object per line;
+# a rewritten log starts with a "seq" record holding the highest pack ever created)
+INDEX_FILE = "index.log"
+
+# Loaded client indexes: client_id -> {"entries": {...}, "packs": {...}}
+_indexes = {}
+
+# Per-client locks guarding the in-memory index, the index log and pack appends
+# against the session's own threads. Other worker processes never touch the same
+# client's packs concurrently: a session holds the client's lease (server.leases).
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def client_lock(client_id):
+    # Returns the lock serializing pack updates of one client within this process
+    with _locks_guard:
+        return _locks.setdefault(client_id, threading.Lock())
+
+
+def client_packs_dir(client_id):
+    return os.path.join(PACKS_ROOT, client_id)
+
+
+def has_pack_storage(client_id):
+    # True if the client has ever stored files in packs
+    return client_id in _indexes or os.path.isdir(client_packs_dir(client_id))
+
+
+def pack_name(number):
+    return f"pack-{number:06d}.dat"
+
+
+def pack_number(name):
+    return int(name[len("pack-"):-len(".dat")])
+
+
+def index_log_signature(client_id):
+    # Size and mtime of the index log, used to notice changes made by another process
+    try:
+        st = os.stat(os.path.join(client_packs_dir(client_id), INDEX_FILE))
+        return st.st_size, st.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_client_index(client_id):
+    # Returns the client's index, replaying the index log on first use or when
+    # another worker process has changed it since (caller holds the client lock)
+    state = _indexes.get(client_id)
+    if state is not None and state["log_signature"] == index_log_signature(client_id):
+        return state
+
+    packs_dir = client_packs_dir(client_id)
+    entries = {}
+    last_pack = None
+    try:
+        with open(os.path.join(packs_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line after a crash; the data it described is dead space
+                    logger.warning("Ignoring corrupt index record for client '%s'", client_id)
+                    continue
+                if record["op"] == "put":
+                    entries[record["path"]] = {k: record[k] for k in ("pack", "offset", "length", "mod_time")}
+                    last_pack = max(last_pack or record["pack"], record["pack"])
+                elif record["op"] == "seq":
+                    last_pack = max(last_pack or record["last_pack"], record["last_pack"])
+                elif record["op"] == "del":
+                    entries.pop(record["path"], None)
+    except FileNotFoundError:
+        pass
+
+    # Pack sizes come from disk so bytes never referenced by the index count as dead
+    packs = {}
+    if os.path.isdir(packs_dir):
+        for name in os.listdir(packs_dir):
+            if name.startswith("pack-") and name.endswith(".dat"):
+                packs[name] = {"size": os.path.getsize(os.path.join(packs_dir, name)), "live": 0}
+    for entry in entries.values():
+        packs.setdefault(entry["pack"], {"size": 0, "live": 0})["live"] += entry["length"]
+
+    # Pack numbers never go down: a removed pack's name may still be linked from a snapshot
+    if packs:
+        last_pack = max(last_pack or max(packs), max(packs))
+    state = {"entries": entries, "packs": packs, "last_pack": last_pack,
+             "log_signature": index_log_signature(client_id)}
+    _indexes[client_id] = state
+    return state
+
+
+def append_index_records(client_id, records):
+    # Appends change records to the client's index log
+    with open(os.path.join(client_packs_dir(client_id), INDEX_FILE), "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+    _indexes[client_id]["log_signature"] = index_log_signature(client_id)
+
+
+def new_pack(state):
+    # Starts a pack numbered above every pack this client ever had, so a name is never reused
+    name = pack_name(pack_number(state["last_pack"]) + 1 if state["last_pack"] else 1)
+    state["last_pack"] = name
+    state["packs"][name] = {"size": 0, "live": 0}
+    return name
+
+
+def current_pack(state):
+    # Returns the pack new data is appended to, starting a new one when the last is full
+    if state["packs"]:
+        last = max(state["packs"])
+        if last == state["last_pack"] and state["packs"][last]["size"] < PACK_MAX_BYTES:
+            return last
+    return new_pack(state)
+
+
+def append_to_pack(client_id, state, data, pack=None):
+    # Appends data to a pack and returns (pack, offset) (caller holds the client lock)
+    pack = pack or current_pack(state)
+    with open(os.path.join(client_packs_dir(client_id), pack), "ab") as f:
+        offset = f.tell()
+        f.write(data)
+    state["packs"][pack]["size"] = offset + len(data)
+    return pack, offset
+
+
+def forget_entry(state, path):
+    # Drops a path from the in-memory index, marking its bytes as dead
+    entry = state["entries"].pop(path, None)
+    if entry:
+        state["packs"][entry["pack"]]["live"] -= entry["length"]
+    return entry
+
+
+def get_packed_index(client_id):
+    # Returns index entries ({"path", "mod_time", "size"}) for all packed files
+    with client_lock(client_id):
+        state = load_client_index(client_id)
+        return [{"path": path, "mod_time": e["mod_time"], "size": e["length"]}
+                for path, e in state["entries"].items()]
+
+
+def is_packed(client_id, path):
+    if not has_pack_storage(client_id):
+        return False
+    with client_lock(client_id):
+        return path in load_client_index(client_id)["entries"]
+
+
+def write_packed_file(client_id, path, data, mod_time):
+    # Stores a small file by appending it to the client's current pack
+    with client_lock(client_id):
+        os.makedirs(client_packs_dir(client_id), exist_ok=True)
+        state = load_client_index(client_id)
+
+        # Data goes in before the index record, so a crash leaves dead bytes, not a broken entry
+        pack, offset = append_to_pack(client_id, state, data)
+        append_index_records(client_id, [{
+            "op": "put", "path": path, "pack": pack, "offset": offset, "length": len(data), "mod_time": mod_time
+        }])
+
+        forget_entry(state, path)
+        state["entries"][path] = {"pack": pack, "offset": offset, "length": len(data), "mod_time": mod_time}
+        state["packs"][pack]["live"] += len(data)
+
+
+def touch_packed_file(client_id, path, mod_time):
+    # Updates the stored mtime of a packed file without rewriting its data
+    with client_lock(client_id):
+        state = load_client_index(client_id)
+        entry = state["entries"][path]
+        entry["mod_time"] = mod_time
+        append_index_records(client_id, [{"op": "put", "path": path, **entry}])
+
+
+def rename_packed_file(client_id, old_path, new_path):
+    # Points a new path at an already packed file's data; no bytes are copied
+    with client_lock(client_id):
+        state = load_client_index(client_id)
+        entry = state["entries"][old_path]
+        append_index_records(client_id, [
+            {"op": "put", "path": new_path, **entry},
+            {"op": "del", "path": old_path}
+        ])
+        forget_entry(state, new_path)
+        state["entries"][new_path] = state["entries"].pop(old_path)
+
+
+def read_packed_file(client_id, path):
+    # Returns the contents of a packed file (KeyError if it is not packed)
+    with client_lock(client_id):
+        entry = dict(load_client_index(client_id)["entries"][path])
+
+    with open(os.path.join(client_packs_dir(client_id), entry["pack"]), "rb") as f:
+        f.seek(entry["offset"])
+        data = f.read(entry["length"])
+    if len(data) != entry["length"]:
+        raise OSError(f"Pack '{entry['pack']}' is truncated at '{path}'")
+    return data
+
+
+def delete_packed_file(client_id, path):
+    # Removes a file from the pack index; its bytes are reclaimed by compaction
+    if not has_pack_storage(client_id):
+        return False
+    with client_lock(client_id):
+        state = load_client_index(client_id)
+        if path not in state["entries"]:
+            return False
+        append_index_records(client_id, [{"op": "del", "path": path}])
+        forget_entry(state, path)
+        return True
+
+
+def preserve_packed_entry(client_id, path, dest_dir):
+    # Keeps a packed file's current data reachable from dest_dir by hardlinking its
+    # pack there (once per pack) and returns its index entry, or None if the path is
+    # not packed. Later appends to a linked pack are harmless and compaction only
+    # ever unlinks packs, so the entry stays valid for the snapshot holding it.
+    if not has_pack_storage(client_id):
+        return None
+
+    with client_lock(client_id):
+        entry = load_client_index(client_id)["entries"].get(path)
+        if entry is None:
+            return None
+        dst = os.path.join(dest_dir, entry["pack"])
+        if not os.path.exists(dst):
+            os.makedirs(dest_dir, exist_ok=True)
+            os.link(os.path.join(client_packs_dir(client_id), entry["pack"]), dst)
+        return dict(entry)
+
+
+def compact_packs(client_id):
+    # Rewrites packs dominated by dead bytes: live files are copied into a fresh
+    # pack, the index log is rewritten atomically, then the old packs are removed
+    if not has_pack_storage(client_id):
+        return
+
+    with client_lock(client_id):
+        state = load_client_index(client_id)
+        victims = [name for name, pack in state["packs"].items()
+                   if pack["size"] and (pack["size"] - pack["live"]) / pack["size"] > COMPACT_DEAD_RATIO]
+        if not victims:
+            return
+
+        packs_dir = client_packs_dir(client_id)
+        reclaimed = sum(state["packs"][name]["size"] - state["packs"][name]["live"] for name in victims)
+        target = None
+
+        for victim in sorted(victims):
+            moved = sorted((e["offset"], path) for path, e in state["entries"].items() if e["pack"] == victim)
+            if not moved:
+                continue
+            with open(os.path.join(packs_dir, victim), "rb") as src:
+                for _, path in moved:
+                    entry = state["entries"][path]
+                    src.seek(entry["offset"])
+                    data = src.read(entry["length"])
+                    if target is None or state["packs"][target]["size"] >= PACK_MAX_BYTES:
+                        # Never append into a pack that is itself being compacted
+                        target = new_pack(state)
+                    pack, offset = append_to_pack(client_id, state, data, target)
+                    state["packs"][pack]["live"] += entry["length"]
+                    state["entries"][path] = {**entry, "pack": pack, "offset": offset}
+
+        tmp_index = os.path.join(packs_dir, INDEX_FILE + ".tmp")
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "seq", "last_pack": state["last_pack"]}) + "\n")
+            for path, entry in state["entries"].items():
+                f.write(json.dumps({"op": "put", "path": path, **entry}) + "\n")
+        os.replace(tmp_index, os.path.join(packs_dir, INDEX_FILE))
+        state["log_signature"] = index_log_signature(client_id)
+
+        for victim in victims:
+            state["packs"].pop(victim, None)
+            try:
+                os.remove(os.path.join(packs_dir, victim))
+            except OSError as e:
+                logger.warning("Failed to remove compacted pack '%s': %s", victim, e)
+
+        logger.info("Compacted %d packs for client '%s', reclaimed %d bytes", len(victims), client_id, reclaimed)
@@ -0,0 +1,225 @@
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from common.protocol import MESSAGE_TYPES
+from common.logger import get_logger
+from server.archive_handler import get_server_file_index, open_archived_file
+from server import snapshots
+
+logger = get_logger("RESTORE")
+
+# Files up to this size are packed together into RESTORE_BUNDLE messages
+BUNDLE_FILE_LIMIT = 256 * 1024
+
+# Upper bound for the payload of a single bundle
+BUNDLE_MAX_BYTES = 4 * 1024 * 1024
+
+# Number of threads reading bundles from disk while the socket is busy sending
+RESTORE_READ_WORKERS = 4
+
+# Number of tasks (bundles or large files) scheduled ahead of the one being sent
+RESTORE_PREFETCH = 8
+
+
+def matches_requested_paths(path, paths):
+    # An empty selection means the full archive; otherwise exact files or directory prefixes
+    if not paths:
+        return True
+    for requested in paths:
+        requested = requested.strip("/")
+        if not requested or path == requested or path.startswith(requested + "/"):
+            return True
+    return False
+
+
+def is_same_version(entry, other):
+    # Two entries describe the same file version if size and mtime agree
+    return other.get("size") == entry["size"] and abs(other.get("mod_time", 0) - entry["mod_time"]) <= 1
+
+
+def plan_restore(server_index, msg):
+    # Select the files to send, skipping ones the client already has and
+    # resuming partially downloaded ones from the offset the client reported
+    paths = msg.get("paths") or []
+    have = {f["path"]: f for f in msg.get("have", [])}
+    partial = {f["path"]: f for f in msg.get("partial", [])}
+
+    selected = []
+    for entry in sorted(server_index, key=lambda f: f["path"]):
+        path = entry["path"]
+        if not matches_requested_paths(path, paths):
+            continue
+        if path in have and is_same_version(entry, have[path]):
+            continue
+
+        offset = 0
+        part = partial.get(path)
+        if part and is_same_version(entry, part) and 0 < part.get("offset", 0) < entry["size"]:
+            offset = part["offset"]
+        selected.append({**entry, "offset": offset})
+
+    return selected
+
+
+def open_restore_source(client_id, entry):
+    # Opens the version of a file being restored: live, or preserved in a snapshot
+    return snapshots.open_snapshot_file(client_id, entry, open_archived_file)
+
+
+def build_restore_tasks(selected):
+    # Groups small files into bundles; large or resumed files are sent on their own
+    tasks = []
+    bundle = []
+    bundle_bytes = 0
+
+    for entry in selected:
+        if entry["size"] > BUNDLE_FILE_LIMIT or entry["offset"]:
+            tasks.append(("file", entry))
+            continue
+
+        if bundle and bundle_bytes + entry["size"] > BUNDLE_MAX_BYTES:
+            tasks.append(("bundle", bundle))
+            bundle = []
+            bundle_bytes = 0
+        bundle.append(entry)
+        bundle_bytes += entry["size"]
+
+    if bundle:
+        tasks.append(("bundle", bundle))
+
+    return tasks
+
+
+def read_bundle(client_id, entries):
+    # Reads the contents of all files of a bundle (runs in the reader pool)
+    contents = []
+    for entry in entries:
+        try:
+            with open_restore_source(client_id, entry) as f:
+                contents.append((entry, f.read()))
+        except Exception as e:
+            logger.warning("Failed to read '%s' for restore: %s", entry["path"], e)
+            contents.append((entry, None))
+    return contents
+
+
+def send_bundle(conn, contents, stats):
+    # Sends one RESTORE_BUNDLE header listing the files, followed by their concatenated data
+    files = []
+    payload = []
+    for entry, data in contents:
+        if data is None:
+            stats["failed_restores"] += 1
+            continue
+        files.append({"path": entry["path"], "size": len(data), "mod_time": entry["mod_time"]})
+        payload.append(data)
+
+    if not files:
+        return
+
+    header = {"type": MESSAGE_TYPES["RESTORE_BUNDLE"], "files": files}
+    conn.sendall((json.dumps(header) + "\n").encode())
+    conn.sendall(b"".join(payload))
+
+    stats["restored_files"] += len(files)
+    stats["restored_bytes"] += sum(f["size"] for f in files)
+
+
+def send_single_file(conn, client_id, entry, stats):
+    # Streams one file starting at the requested offset (zero-copy for plain files)
+    path = entry["path"]
+    try:
+        f = open_restore_source(client_id, entry)
+    except Exception as e:
+        logger.warning("Failed to open '%s' for restore: %s", path, e)
+        stats["failed_restores"] += 1
+        return
+
+    with f:
+        size = f.seek(0, 2)
+        offset = entry["offset"] if entry["offset"] < size else 0
+
+        header = {
+            "type": MESSAGE_TYPES["RESTORE_FILE"],
+            "path": path,
+            "size": size,
+            "offset": offset,
+            "mod_time": entry["mod_time"]
+        }
+        conn.sendall((json.dumps(header) + "\n").encode())
+
+        # sendfile only seeks for non-zero offsets when it falls back to send() (packed files)
+        f.seek(offset)
+        sent = conn.sendfile(f, offset, size - offset)
+        if sent != size - offset:
+            raise Exception(f"File '{path}' changed while being restored.")
+
+    stats["restored_files"] += 1
+    stats["restored_bytes"] += size - offset
+
+
+def handle_restore_request(conn, msg, addr, stats):
+    # Handles RESTORE_REQUEST message: streams the selected archive files back to the client
+    client_id = msg.get("client_id")
+    if not client_id:
+        logger.warning("RESTORE_REQUEST without client_id from %s", addr)
+        return None
+
+    server_index = get_server_file_index(client_id)
+    available = snapshots.list_snapshots(client_id)
+    snapshot = msg.get("snapshot")
+    if snapshot:
+        if snapshot not in available:
+            logger.warning("Client %s requested unknown snapshot '%s'", addr, snapshot)
+            error = {
+                "type": MESSAGE_TYPES["RESTORE_INFO"],
+                "error": f"Unknown snapshot '{snapshot}'",
+                "snapshots": available
+            }
+            conn.sendall((json.dumps(error) + "\n").encode())
+            return client_id
+        # The snapshot's tree: the live index overlaid with the versions preserved since
+        server_index = list(snapshots.snapshot_index(client_id, snapshot, server_index).values())
+
+    selected = plan_restore(server_index, msg)
+    info = {
+        "type": MESSAGE_TYPES["RESTORE_INFO"],
+        "files": [{"path": f["path"], "size": f["size"], "mod_time": f["mod_time"]} for f in selected],
+        "total_bytes": sum(f["size"] - f["offset"] for f in selected),
+        "snapshots": available
+    }
+    conn.sendall((json.dumps(info) + "\n").encode())
+    logger.info("Restoring %d files (%d bytes)%s to %s", len(selected), info["total_bytes"],
+                f" from snapshot '{snapshot}'" if snapshot else "", addr)
+
+    tasks = iter(build_restore_tasks(selected))
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=RESTORE_READ_WORKERS) as pool:
+        def schedule():
+            # Keeps up to RESTORE_PREFETCH tasks in flight; bundles start reading immediately
+            while len(pending) < RESTORE_PREFETCH:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                kind, payload = task
+                future = pool.submit(read_bundle, client_id, payload) if kind == "bundle" else None
+                pending.append((kind, payload, future))
+
+        schedule()
+        while pending:
+            kind, payload, future = pending.popleft()
+            schedule()
+            if kind == "bundle":
+                send_bundle(conn, future.result(), stats)
+            else:
+                send_single_file(conn, client_id, payload, stats)
+
+    done = {
+        "type": MESSAGE_TYPES["RESTORE_DONE"],
+        "restored_files": stats["restored_files"],
+        "failed_files": stats["failed_restores"]
+    }
+    conn.sendall((json.dumps(done) + "\n").encode())
+    return client_id
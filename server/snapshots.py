@@ -0,0 +1,209 @@
+import io
+import os
+import json
+import shutil
+import threading
+from datetime import datetime, timezone
+from common.logger import get_logger
+from server.pack_storage import preserve_packed_entry
+
+logger = get_logger("SNAPSHOTS")
+
+# Take a point-in-time snapshot of the client's archive after every session that changed it
+SNAPSHOT_MODE = False
+
+# Root directory holding snapshots/<client_id>/<timestamp>/{manifest.log,files,packs}
+SNAPSHOTS_ROOT = "snapshots"
+
+# Number of most recent snapshots kept per client (0 keeps all)
+SNAPSHOT_RETENTION = 10
+
+# Snapshots older than this many days are pruned (0 disables age-based pruning)
+SNAPSHOT_MAX_AGE_DAYS = 0
+
+# Timestamp format of snapshot directory names; sorts chronologically
+SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+# Per-snapshot log of the versions preserved in it ("file", "packed" or "absent"
+# records, one JSON object per line)
+MANIFEST_FILE = "manifest.log"
+
+# Paths already preserved in each client's newest snapshot:
+# client_id -> {"name", "signature", "paths"}; only touched under the client's lease
+_preserved = {}
+
+
+def client_snapshots_dir(client_id):
+    return os.path.join(SNAPSHOTS_ROOT, client_id)
+
+
+def list_snapshots(client_id):
+    # Returns the client's snapshot names, oldest first
+    try:
+        names = os.listdir(client_snapshots_dir(client_id))
+    except FileNotFoundError:
+        return []
+    return sorted(names)
+
+
+def link_or_copy(src, dst):
+    # Shares the file with the live archive; falls back to a copy where hardlinks are unsupported
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        logger.warning("Hardlink failed, copying '%s' instead: %s", src, e)
+        shutil.copy2(src, dst)
+
+
+def manifest_signature(snapshot_dir):
+    # Size and mtime of the manifest, used to notice records written by another process
+    try:
+        st = os.stat(os.path.join(snapshot_dir, MANIFEST_FILE))
+        return st.st_size, st.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_manifest(snapshot_dir):
+    # Returns the snapshot's manifest records keyed by path (the first record of a path wins)
+    records = {}
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Ignoring corrupt manifest record in '%s'", snapshot_dir)
+                    continue
+                records.setdefault(record["path"], record)
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def preserved_paths(client_id, name):
+    # Returns the preservation state of the client's newest snapshot, re-reading the
+    # manifest when the snapshot changed or another worker process appended to it
+    snapshot_dir = os.path.join(client_snapshots_dir(client_id), name)
+    signature = manifest_signature(snapshot_dir)
+    state = _preserved.get(client_id)
+    if state is None or state["name"] != name or state["signature"] != signature:
+        state = {"name": name, "signature": signature, "paths": set(load_manifest(snapshot_dir))}
+        _preserved[client_id] = state
+    return state
+
+
+def preserve_current_version(client_id, path, full_path):
+    # Called before an archived path is replaced, deleted, moved away or re-dated.
+    # Keeps the version the newest snapshot saw (once per path): plain files are
+    # hardlinked into the snapshot, packed files keep their pack linked, and paths
+    # that did not exist yet are recorded as absent. The mtime goes into the
+    # manifest, so later in-place mtime updates never alter the snapshot.
+    if not SNAPSHOT_MODE:
+        return
+    name = (list_snapshots(client_id) or [None])[-1]
+    if name is None:
+        return
+
+    try:
+        state = preserved_paths(client_id, name)
+        if path in state["paths"]:
+            return
+
+        snapshot_dir = os.path.join(client_snapshots_dir(client_id), name)
+        entry = preserve_packed_entry(client_id, path, os.path.join(snapshot_dir, "packs"))
+        if entry is not None:
+            record = {"path": path, "state": "packed", "size": entry["length"], **entry}
+        elif os.path.exists(full_path):
+            st = os.stat(full_path)
+            dst = os.path.join(snapshot_dir, "files", path)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            link_or_copy(full_path, dst)
+            record = {"path": path, "state": "file", "size": st.st_size, "mod_time": st.st_mtime}
+        else:
+            record = {"path": path, "state": "absent"}
+
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        state["paths"].add(path)
+        state["signature"] = manifest_signature(snapshot_dir)
+    except Exception as e:
+        logger.error("Failed to preserve '%s' in snapshot '%s' of client '%s': %s", path, name, client_id, e)
+
+
+def create_snapshot(client_id):
+    # Marks the current state of the archive as a snapshot. Snapshots are reverse
+    # deltas: the live archive is the newest snapshot, and each snapshot only holds
+    # the versions that changed after it was taken (see preserve_current_version).
+    # Taking one is a single mkdir; its cost is paid per changed path later on.
+    name = datetime.now(timezone.utc).strftime(SNAPSHOT_NAME_FORMAT)
+    try:
+        os.makedirs(os.path.join(client_snapshots_dir(client_id), name))
+        logger.info("Created snapshot '%s' for client '%s'", name, client_id)
+        return name
+    except OSError as e:
+        logger.error("Failed to create snapshot for client '%s': %s", client_id, e)
+        return None
+
+
+def snapshot_index(client_id, name, live_index):
+    # Describes the archive as it was when snapshot name was taken: the live index
+    # overlaid with the versions preserved in that snapshot and every newer one,
+    # newest first, so the oldest preserved version of a path wins. Returns
+    # {path: entry}; preserved entries also carry "snapshot" and "record".
+    names = list_snapshots(client_id)
+    index = {f["path"]: dict(f) for f in live_index}
+    for newer in reversed(names[names.index(name):]):
+        manifest = load_manifest(os.path.join(client_snapshots_dir(client_id), newer))
+        for path, record in manifest.items():
+            if record["state"] == "absent":
+                index.pop(path, None)
+            else:
+                index[path] = {"path": path, "mod_time": record["mod_time"], "size": record["size"],
+                               "snapshot": newer, "record": record}
+    return index
+
+
+def open_snapshot_file(client_id, entry, open_live):
+    # Opens a file listed by snapshot_index; open_live(client_id, path) opens live versions
+    if "snapshot" not in entry:
+        return open_live(client_id, entry["path"])
+
+    snapshot_dir = os.path.join(client_snapshots_dir(client_id), entry["snapshot"])
+    record = entry["record"]
+    if record["state"] == "packed":
+        with open(os.path.join(snapshot_dir, "packs", record["pack"]), "rb") as f:
+            f.seek(record["offset"])
+            return io.BytesIO(f.read(record["length"]))
+    return open(os.path.join(snapshot_dir, "files", entry["path"]), "rb")
+
+
+def prune_snapshots(client_id):
+    # Removes snapshots beyond SNAPSHOT_RETENTION or older than SNAPSHOT_MAX_AGE_DAYS.
+    # Only the oldest snapshots are ever pruned, and no newer snapshot depends on
+    # them. Deleting one only unlinks its files; data still referenced elsewhere stays.
+    names = list_snapshots(client_id)
+    expired = set()
+
+    if SNAPSHOT_RETENTION and len(names) > SNAPSHOT_RETENTION:
+        expired.update(names[:-SNAPSHOT_RETENTION])
+
+    if SNAPSHOT_MAX_AGE_DAYS:
+        now = datetime.now(timezone.utc)
+        for name in names[:-1]:  # Never prune the newest snapshot by age
+            try:
+                taken = datetime.strptime(name, SNAPSHOT_NAME_FORMAT).replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            if (now - taken).days >= SNAPSHOT_MAX_AGE_DAYS:
+                expired.add(name)
+
+    for name in sorted(expired):
+        shutil.rmtree(os.path.join(client_snapshots_dir(client_id), name), ignore_errors=True)
+        logger.info("Pruned snapshot '%s' of client '%s'", name, client_id)
+
+
+def snapshot_client_archive(client_id):
+    # Takes a snapshot, then prunes old snapshots in a background thread
+    if create_snapshot(client_id) is not None:
+        threading.Thread(target=prune_snapshots, args=(client_id,), daemon=True).start()
@@ -2,15 +2,28 @@ import socket
 import threading
 import queue
 import json
-import os
+import time
 
 from common.protocol import MESSAGE_TYPES, make_next_sync_message
+from common.logger import get_logger
 from server.archive_handler import (
     ensure_client_archive_dir,
     get_server_file_index,
     compare_file_indexes,
-    save_file_stream
+    save_file_stream,
+    delete_archived_file,
+    touch_archived_file,
+    move_archived_file,
+    detect_moves,
+    filter_unchanged_files,
+    prune_fingerprint_cache,
+    compact_client_storage
 )
+from server.restore_handler import handle_restore_request
+from server.leases import acquire_client_lease, release_client_lease
+from server import snapshots
+
+logger = get_logger("TCP SERVER")
 
 # Lock to safely manage access to the active client
 active_client_lock = threading.Lock()
@@ -21,6 +34,24 @@ active_client = None
 # Queue for clients waiting to be served
 client_queue = queue.Queue()
 
+# Counters shared with the other worker processes (None when running as a single process)
+shared_metrics = None
+
+
+def set_shared_metrics(metrics):
+    # Installs the cross-process counters created by the parent (multi-process mode)
+    global shared_metrics
+    shared_metrics = metrics
+
+
+def add_shared_metric(name, amount):
+    # Adds to a cross-process counter; a no-op in single-process mode
+    if shared_metrics is None:
+        return
+    value = shared_metrics[name]
+    with value.get_lock():
+        value.value += amount
+
 
 def recv_json_message(conn):
     # Receives a JSON message terminated by a newline character '\n'
@@ -37,20 +68,23 @@ def recv_json_message(conn):
     except json.JSONDecodeError:
         return None
     except Exception as e:
-        print(f"[TCP SERVER] Error receiving JSON message: {e}")
+        logger.warning("Error receiving JSON message: %s", e)
         return None
 
 
 def handle_client(conn, addr, sync_interval_seconds):
     # Top-level handler for a client connection
     global active_client
-    print(f"[TCP SERVER] Connected with client {addr}")
+    logger.info("Connected with client %s", addr)
+    add_shared_metric("active_sessions", 1)
 
     try:
         process_client_session(conn, addr, sync_interval_seconds)
     except Exception as e:
-        print(f"[TCP SERVER] Error with {addr}: {e}")
+        logger.error("Error with %s: %s", addr, e)
     finally:
+        add_shared_metric("active_sessions", -1)
+        add_shared_metric("completed_sessions", 1)
         cleanup_connection(conn, addr)
         start_next_client(sync_interval_seconds)
 
@@ -59,29 +93,101 @@ def process_client_session(conn, addr, sync_interval_seconds):
     # Processes the client's session by handling messages and file transfers
     client_id = None
     expected_files = {}
+    stats = new_session_stats()
+    lease = None
 
-    while True:
-        msg = recv_json_message(conn)
-        if not msg:
-            print(f"[TCP SERVER] Client {addr} disconnected or sent invalid message.")
-            break
-
-        msg_type = msg.get("type")
-        if msg_type == MESSAGE_TYPES.get("FILE_INFO"):
-            client_id, expected_files = handle_file_info(conn, msg, sync_interval_seconds, addr)
-            if not expected_files:
+    try:
+        while True:
+            msg = recv_json_message(conn)
+            if not msg:
+                logger.info("Client %s disconnected or sent invalid message.", addr)
                 break
-        elif msg_type == MESSAGE_TYPES.get("FILE_TRANSFER"):
-            handle_file_transfer(conn, msg, client_id, expected_files, sync_interval_seconds, addr)
-            if not expected_files:
+
+            msg_type = msg.get("type")
+            if (msg_type in (MESSAGE_TYPES.get("FILE_INFO"), MESSAGE_TYPES.get("RESTORE_REQUEST"))
+                    and lease is None and msg.get("client_id")):
+                # Another worker process may be serving the same client; never touch its archive concurrently
+                lease = acquire_client_lease(msg["client_id"])
+                if lease is None:
+                    logger.info("Client '%s' has a session in another worker. Sent BUSY to %s", msg.get("client_id"), addr)
+                    conn.sendall((json.dumps({"type": MESSAGE_TYPES["BUSY"]}) + "\n").encode())
+                    break
+
+            if msg_type == MESSAGE_TYPES.get("FILE_INFO"):
+                client_id, expected_files = handle_file_info(conn, msg, sync_interval_seconds, addr, stats)
+                if not expected_files:
+                    break
+            elif msg_type == MESSAGE_TYPES.get("FILE_TRANSFER"):
+                handle_file_transfer(conn, msg, client_id, expected_files, sync_interval_seconds, addr, stats)
+                if not expected_files:
+                    break
+            elif msg_type == MESSAGE_TYPES.get("RESTORE_REQUEST"):
+                client_id = handle_restore_request(conn, msg, addr, stats)
                 break
-        else:
-            print(f"[TCP SERVER] Unknown message type from {addr}: {msg_type}")
+            else:
+                logger.warning("Unknown message type from %s: %s", addr, msg_type)
+    finally:
+        if client_id:
+            compact_client_storage(client_id)
+            if snapshots.SNAPSHOT_MODE and not expected_files and session_changed_archive(stats):
+                snapshots.snapshot_client_archive(client_id)
+        release_client_lease(lease)
+        log_session_summary(addr, client_id, expected_files, stats)
 
     return client_id, expected_files
 
 
-def handle_file_info(conn, msg, sync_interval_seconds, addr):
+def new_session_stats():
+    # Counters accumulated over one client session and reported once at the end
+    return {
+        "started": time.monotonic(),
+        "received_files": 0,
+        "received_bytes": 0,
+        "deleted_files": 0,
+        "failed_deletes": 0,
+        "touched_files": 0,
+        "moved_files": 0,
+        "restored_files": 0,
+        "restored_bytes": 0,
+        "failed_restores": 0,
+    }
+
+
+def session_changed_archive(stats):
+    # True if the session stored, removed, renamed or re-dated any archived file
+    return any(stats[name] for name in ("received_files", "deleted_files", "moved_files", "touched_files"))
+
+
+def log_session_summary(addr, client_id, expected_files, stats):
+    # Emits a single summary line for the session instead of one line per file
+    elapsed = time.monotonic() - stats["started"]
+    for name in ("received_files", "received_bytes", "restored_files", "restored_bytes"):
+        add_shared_metric(name, stats[name])
+    logger.info(
+        "Session summary for %s (client '%s'): %d files received (%d bytes), %d unchanged, "
+        "%d moved, %d deleted, %d failed deletes, %d missing, %d restored (%d bytes), %.2fs",
+        addr, client_id, stats["received_files"], stats["received_bytes"], stats["touched_files"],
+        stats["moved_files"], stats["deleted_files"], stats["failed_deletes"], len(expected_files),
+        stats["restored_files"], stats["restored_bytes"], elapsed,
+        extra={"fields": {
+            "event": "session_summary",
+            "client_id": client_id,
+            "received_files": stats["received_files"],
+            "received_bytes": stats["received_bytes"],
+            "touched_files": stats["touched_files"],
+            "moved_files": stats["moved_files"],
+            "deleted_files": stats["deleted_files"],
+            "failed_deletes": stats["failed_deletes"],
+            "missing_files": len(expected_files),
+            "restored_files": stats["restored_files"],
+            "restored_bytes": stats["restored_bytes"],
+            "failed_restores": stats["failed_restores"],
+            "elapsed_seconds": round(elapsed, 3),
+        }}
+    )
+
+
+def handle_file_info(conn, msg, sync_interval_seconds, addr, stats):
     # Handles FILE_INFO message: determines which files need to be uploaded or deleted
     client_id = msg["client_id"]
     ensure_client_archive_dir(client_id)
@@ -91,43 +197,77 @@ def handle_file_info(conn, msg, sync_interval_seconds, addr):
     client_index = {f["path"]: f["mod_time"] for f in client_files}
 
     to_upload, to_delete = compare_file_indexes(server_index, client_index)
-    expected_files = {f["path"]: f for f in client_files if f["path"] in to_upload}
-    client_dir = os.path.join("archives", client_id)
+    client_entries = {f["path"]: f for f in client_files}
+
+    # Renamed or moved files are renamed on the server instead of deleted and re-uploaded
+    moves = detect_moves(client_id, server_index, client_entries, to_upload, to_delete)
+    moved_from = set()
+    moved_to = set()
+    for old_path, new_path in moves:
+        try:
+            move_archived_file(client_id, old_path, new_path)
+            # Matching allows up to 1s of drift; the stored copy takes the client's mtime
+            touch_archived_file(client_id, new_path, client_index[new_path])
+            moved_from.add(old_path)
+            moved_to.add(new_path)
+            stats["moved_files"] += 1
+            logger.debug("Moved '%s' to '%s'", old_path, new_path)
+        except Exception as e:
+            logger.warning("Failed to move '%s' to '%s': %s", old_path, new_path, e)
+    if moves:
+        to_upload = [path for path in to_upload if path not in moved_to]
+        to_delete = [path for path in to_delete if path not in moved_from]
+
+    if msg.get("verify"):
+        # Files whose content is unchanged only get their stored mtime updated
+        to_upload, unchanged = filter_unchanged_files(client_id, server_index, client_entries, to_upload)
+        for path in unchanged:
+            try:
+                touch_archived_file(client_id, path, client_index[path])
+                stats["touched_files"] += 1
+            except Exception as e:
+                logger.warning("Failed to update mtime of '%s': %s", path, e)
+                to_upload.append(path)
 
+    to_upload = set(to_upload)
+    expected_files = {f["path"]: f for f in client_files if f["path"] in to_upload}
     for path in to_delete:
         try:
-            full_path = os.path.join(client_dir, path)
-            if os.path.exists(full_path):
-                os.remove(full_path)
-                print(f"[TCP SERVER] Deleted file '{path}' no longer present on client")
+            if delete_archived_file(client_id, path):
+                stats["deleted_files"] += 1
+                logger.debug("Deleted file '%s' no longer present on client", path)
         except Exception as e:
-            print(f"[TCP SERVER] Failed to delete '{path}': {e}")
+            stats["failed_deletes"] += 1
+            logger.warning("Failed to delete '%s': %s", path, e)
+
+    # After this sync the archive holds exactly the client's paths
+    prune_fingerprint_cache(client_id, client_index)
 
     if not expected_files:
         conn.send((json.dumps(make_next_sync_message(str(sync_interval_seconds))) + "\n").encode())
-        print(f"[TCP SERVER] No files to upload. Sent NEXT_SYNC to {addr}")
+        logger.info("No files to upload. Sent NEXT_SYNC to %s", addr)
     else:
         archive_tasks = {
             "type": MESSAGE_TYPES["ARCHIVE_TASKS"],
             "upload": [{"path": path} for path in expected_files]
         }
         conn.send((json.dumps(archive_tasks) + "\n").encode())
-        print(f"[TCP SERVER] Sent ARCHIVE_TASKS to {addr}")
+        logger.info("Sent ARCHIVE_TASKS (%d files) to %s", len(expected_files), addr)
 
     return client_id, expected_files
 
 
-def handle_file_transfer(conn, msg, client_id, expected_files, sync_interval_seconds, addr):
+def handle_file_transfer(conn, msg, client_id, expected_files, sync_interval_seconds, addr, stats):
     # Handles FILE_TRANSFER message: receives and saves a file
     path = msg.get("path")
     size = msg.get("size")
     mod_time = msg.get("mod_time")
 
     if not path or size is None or mod_time is None:
-        print(f"[TCP SERVER] Incomplete FILE_TRANSFER metadata from {addr}")
+        logger.warning("Incomplete FILE_TRANSFER metadata from %s", addr)
         return
 
-    print(f"[TCP SERVER] Receiving file '{path}' ({size} bytes) from {addr}")
+    logger.debug("Receiving file '%s' (%d bytes) from %s", path, size, addr)
     received_data = b""
 
     while len(received_data) < size:
@@ -137,12 +277,14 @@ def handle_file_transfer(conn, msg, client_id, expected_files, sync_interval_sec
         received_data += chunk
 
     save_file_stream(client_id, path, received_data, mod_time)
-    print(f"[TCP SERVER] Saved file '{path}'")
+    logger.debug("Saved file '%s'", path)
     expected_files.pop(path, None)
+    stats["received_files"] += 1
+    stats["received_bytes"] += size
 
     if not expected_files:
         conn.send((json.dumps(make_next_sync_message(str(sync_interval_seconds))) + "\n").encode())
-        print(f"[TCP SERVER] Sent NEXT_SYNC to {addr}")
+        logger.info("Sent NEXT_SYNC to %s", addr)
 
 
 def cleanup_connection(conn, addr):
@@ -154,7 +296,7 @@ def cleanup_connection(conn, addr):
     with active_client_lock:
         global active_client
         active_client = None
-    print(f"[TCP SERVER] Session with {addr} ended.")
+    logger.info("Session with %s ended.", addr)
 
 
 def start_next_client(sync_interval_seconds):
@@ -166,11 +308,11 @@ def start_next_client(sync_interval_seconds):
             conn, addr = client_queue.get()
             try:
                 conn.send((json.dumps({"type": MESSAGE_TYPES["READY"]}) + "\n").encode())
-                print(f"[TCP SERVER] Sent READY to {addr}")
+                logger.info("Sent READY to %s", addr)
                 active_client = conn
                 threading.Thread(target=handle_client, args=(conn, addr, sync_interval_seconds), daemon=True).start()
             except Exception as e:
-                print(f"[TCP SERVER] Failed to resume client {addr}: {e}")
+                logger.warning("Failed to resume client %s: %s", addr, e)
                 try:
                     conn.close()
                 except Exception:
@@ -179,20 +321,26 @@ def start_next_client(sync_interval_seconds):
                 start_next_client(sync_interval_seconds)
 
 
-def start_tcp_server(host='0.0.0.0', port=6001, sync_interval_seconds=60):
-    # Starts the TCP server, listens for clients, and manages the active session queue
+def start_tcp_server(host='0.0.0.0', port=6001, sync_interval_seconds=60, reuse_port=False):
+    # Starts the TCP server, listens for clients, and manages the active session queue.
+    # With reuse_port, several worker processes can listen on the same port and the
+    # kernel spreads incoming connections between them. A busy worker then does not
+    # queue the client behind its own session; it tells it to reconnect, so the next
+    # attempt can reach an idle worker. Returns False if binding fails.
     global active_client
 
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
     try:
         server_socket.bind((host, port))
         server_socket.listen(5)
-        print(f"[TCP SERVER] Listening for TCP connections on port {port}")
+        logger.info("Listening for TCP connections on port %d", port)
     except Exception as e:
-        print(f"[TCP SERVER] Failed to bind TCP socket: {e}")
-        return
+        logger.error("Failed to bind TCP socket: %s", e)
+        return False
 
     def listener():
         # Accepts new connections and routes them based on server availability
@@ -201,27 +349,37 @@ def start_tcp_server(host='0.0.0.0', port=6001, sync_interval_seconds=60):
         while True:
             try:
                 conn, addr = server_socket.accept()
-                print("===== NEW CLIENT TRYING TO CONNECT... =====")
-                print(f"[TCP SERVER] Incoming connection from {addr}")
+                logger.info("Incoming connection from %s", addr)
 
                 with active_client_lock:
                     if active_client is None:
                         conn.send((json.dumps({"type": MESSAGE_TYPES["READY"]}) + "\n").encode())
                         active_client = conn
                         threading.Thread(target=handle_client, args=(conn, addr, sync_interval_seconds), daemon=True).start()
+                    elif reuse_port:
+                        logger.info("Worker is busy. Asking %s to reconnect", addr)
+                        try:
+                            conn.send((json.dumps({"type": MESSAGE_TYPES["BUSY"], "reconnect": True}) + "\n").encode())
+                        except Exception as e:
+                            logger.warning("Failed to redirect %s: %s", addr, e)
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
                     else:
-                        print(f"[TCP SERVER] Server is busy. Queuing {addr}")
+                        logger.info("Server is busy. Queuing %s", addr)
                         try:
                             conn.send((json.dumps({"type": MESSAGE_TYPES["BUSY"]}) + "\n").encode())
                             client_queue.put((conn, addr))
                         except Exception as e:
-                            print(f"[TCP SERVER] Failed to queue {addr}: {e}")
+                            logger.warning("Failed to queue %s: %s", addr, e)
                             try:
                                 conn.close()
                             except Exception:
                                 pass
             except Exception as e:
-                print(f"[TCP SERVER] Listener error: {e}")
+                logger.error("Listener error: %s", e)
 
     # Start listener in a background thread
     threading.Thread(target=listener, daemon=True).start()
+    return True
@@ -4,6 +4,9 @@ import threading
 import json
 from common.protocol import make_offer_message, MESSAGE_TYPES
 from common.utils import MULTICAST_GROUP, MULTICAST_PORT
+from common.logger import get_logger
+
+logger = get_logger("UDP SERVER")
 
 
 def start_udp_discovery_server(tcp_port):
@@ -21,9 +24,9 @@ def start_udp_discovery_server(tcp_port):
             mreq = struct.pack('4sL', socket.inet_aton(MULTICAST_GROUP), socket.INADDR_ANY)
             sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
 
-            print(f"[UDP SERVER] Listening for DISCOVER on {MULTICAST_GROUP}:{MULTICAST_PORT}")
+            logger.info("Listening for DISCOVER on %s:%d", MULTICAST_GROUP, MULTICAST_PORT)
         except Exception as e:
-            print(f"[UDP SERVER] Failed to initialize UDP socket: {e}")
+            logger.error("Failed to initialize UDP socket: %s", e)
             return  # Stop thread if socket setup fails
 
         while True:
@@ -35,18 +38,18 @@ def start_udp_discovery_server(tcp_port):
                 try:
                     msg = json.loads(data.decode())
                     if msg.get("type") == MESSAGE_TYPES["DISCOVER"]:
-                        print(f"[UDP SERVER] Received DISCOVER from {addr}")
+                        logger.debug("Received DISCOVER from %s", addr)
 
                         offer_msg = make_offer_message(tcp_port)
                         sock.sendto(json.dumps(offer_msg).encode(), addr)
-                        print(f"[UDP SERVER] Sent OFFER to {addr}")
+                        logger.debug("Sent OFFER to %s", addr)
                 except json.JSONDecodeError:
-                    print(f"[UDP SERVER] Received invalid JSON from {addr}")
+                    logger.warning("Received invalid JSON from %s", addr)
                 except Exception as e:
-                    print(f"[UDP SERVER] Error handling DISCOVER message: {e}")
+                    logger.warning("Error handling DISCOVER message: %s", e)
 
             except Exception as e:
-                print(f"[UDP SERVER] Error receiving packet: {e}")
+                logger.error("Error receiving packet: %s", e)
 
     # Start the discovery server in a daemon thread
     thread = threading.Thread(target=server_thread, daemon=True)
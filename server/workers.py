@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import signal
+import socket
+import multiprocessing
+from common.logger import setup_logging, shutdown_logging, get_logger
+from server.tcp_server import start_tcp_server, set_shared_metrics
+
+logger = get_logger("WORKERS")
+
+# Worker log files, one per process so JSON lines never interleave
+WORKER_LOG_FILE = "server-worker{}.log"
+
+# Counters aggregated across all worker processes
+METRIC_NAMES = (
+    "active_sessions",
+    "completed_sessions",
+    "received_files",
+    "received_bytes",
+    "restored_files",
+    "restored_bytes",
+)
+
+# Exit code of a worker that could not bind the shared port; restarting it would not help
+WORKER_BIND_FAILED = 3
+
+# A worker dying sooner than this (seconds) after its start is crash-looping and is not restarted
+WORKER_MIN_UPTIME = 30
+
+# Workers are started with "spawn" so they never inherit the parent's threads
+_context = multiprocessing.get_context("spawn")
+
+
+def reuse_port_supported():
+    # SO_REUSEPORT lets every worker accept on the same port (Linux, BSD, macOS)
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def create_shared_state():
+    # Counters shared by all worker processes (pack storage is guarded per client by leases)
+    return {
+        "metrics": {name: _context.Value("q", 0) for name in METRIC_NAMES},
+    }
+
+
+def read_metrics(metrics):
+    return {name: value.value for name, value in metrics.items()}
+
+
+def worker_main(worker_id, port, sync_interval_seconds, shared_state):
+    # Entry point of a worker process: serves TCP clients on the shared port
+    # The parent handles Ctrl+C and terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(WORKER_LOG_FILE.format(worker_id))
+
+    set_shared_metrics(shared_state["metrics"])
+
+    if not start_tcp_server(port=port, sync_interval_seconds=sync_interval_seconds, reuse_port=True):
+        # Child processes skip atexit handlers, so queued log records are flushed here
+        shutdown_logging()
+        sys.exit(WORKER_BIND_FAILED)
+
+    logger.info("Worker %d (pid %d) accepting connections on port %d", worker_id, os.getpid(), port)
+    while True:
+        time.sleep(1)
+
+
+def start_worker_process(worker_id, port, sync_interval_seconds, shared_state):
+    # Starts one worker process accepting on the shared TCP port via SO_REUSEPORT
+    process = _context.Process(
+        target=worker_main,
+        args=(worker_id, port, sync_interval_seconds, shared_state),
+        name=f"filesync-worker-{worker_id}",
+        daemon=True
+    )
+    process.start()
+    return process
+
+
+def start_worker_processes(count, port, sync_interval_seconds, shared_state):
+    # Starts count workers; returns {worker_id: (process, start time)} for supervise_workers
+    return {
+        worker_id: (start_worker_process(worker_id, port, sync_interval_seconds, shared_state), time.monotonic())
+        for worker_id in range(1, count + 1)
+    }
+
+
+def supervise_workers(workers, port, sync_interval_seconds, shared_state):
+    # Restarts workers that died. Returns False when a worker cannot be kept running:
+    # it failed to bind the port or crashed again shortly after being started.
+    for worker_id, (process, started) in list(workers.items()):
+        if process.is_alive():
+            continue
+
+        logger.error("Worker %d (pid %d) exited with code %s", worker_id, process.pid, process.exitcode)
+        if process.exitcode == WORKER_BIND_FAILED:
+            logger.critical("Worker %d could not bind TCP port %d", worker_id, port)
+            return False
+        if time.monotonic() - started < WORKER_MIN_UPTIME:
+            logger.critical("Worker %d died within %d seconds of starting; not restarting it", worker_id, WORKER_MIN_UPTIME)
+            return False
+
+        process = start_worker_process(worker_id, port, sync_interval_seconds, shared_state)
+        workers[worker_id] = (process, time.monotonic())
+        logger.warning("Restarted worker %d (pid %d)", worker_id, process.pid)
+
+    return True